@@ -2,19 +2,22 @@ import sys
 import os
 import time
 from datetime import datetime
-import vk_api
 from PySide6.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton,
-    QVBoxLayout, QHBoxLayout, QTextEdit, QMessageBox, QSplitter, QDateTimeEdit, QCheckBox
+    QVBoxLayout, QHBoxLayout, QPlainTextEdit, QMessageBox, QSplitter, QDateTimeEdit, QCheckBox, QComboBox,
+    QSpinBox
 )
-from PySide6.QtCore import Qt, QThread, Signal, Slot
+from PySide6.QtCore import Qt, QThread, QTimer, Signal, Slot
 from PySide6 import QtGui
 
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from collections import deque
 
-import threading 
-
-import random
+from postal_core import (
+    load_config, save_config, log_level, PostingEngine, CheckAndClearEngine, EditPostponedEngine, JsonLogFile,
+    ApiSession,
+    EMOJI_LIST, LOG_LEVELS, LOG_PATH
+)
 
 
 def resource_path(relative_path):
@@ -26,280 +29,85 @@ def resource_path(relative_path):
 
 
 
-CONFIG_PATH = os.path.join(os.path.dirname(sys.argv[0]), "last_settings.cfg")
-
-
-
-def load_config():
-    if not os.path.exists(CONFIG_PATH):
-        return {}
-    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    config = {}
-    try:
-        config["token"] = lines[0].strip() if len(lines) > 0 else ""
-        config["group_id"] = lines[1].strip() if len(lines) > 1 else ""
-        config["photos_per_post"] = lines[2].strip() if len(lines) > 2 else "9"
-        if len(lines) > 3:
-            config["last_post_time"] = int(lines[3].strip())
-        else:
-            config["last_post_time"] = None
-    except Exception:
-        return {}
-    return config
-
-
-def save_config(token="", group_id="", photos_per_post="9", last_post_time=None):
-    try:
-        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
-            f.write(f"{token}\n")
-            f.write(f"{group_id}\n")
-            f.write(f"{photos_per_post}\n")
-            if last_post_time is not None:
-                f.write(f"{last_post_time}\n")
-    except Exception as e:
-        print(f"[🧰ERROR] Не удалось сохранить конфиг: {e}")
-
-
-
 class PosterWorker(QThread):
     log_signal = Signal(str)
     finished_signal = Signal()
     update_last_post_time = Signal(int)
 
-    def __init__(self, token, group_id, interval_hours, folder_path, start_timestamp,
-                 photos_per_post, caption="", use_random_emoji=False, emoji_list=None):
+    def __init__(self, *args, engine="threads", dry_run=False, **kwargs):
         super().__init__()
-        self.token = token
-        self.group_id = group_id
-        self.interval_hours = interval_hours
-        self.folder_path = folder_path
-        self.start_timestamp = start_timestamp
-        self.photos_per_post = photos_per_post
-        self.posts_saved = 0
-        self.paused = False
-        self.pause_cond = threading.Condition(threading.Lock())
-        self.caption = caption
-        self.use_random_emoji = use_random_emoji
-        self.emoji_list = emoji_list or []
-    
-    def toggle_pause(self):
-        with self.pause_cond:
-            self.paused = not self.paused
-            if not self.paused:
-                self.pause_cond.notify()
-
-    def run(self):
-        try:
-            self.log_signal.emit("[📶] Подключение к API ВКонтакте...")
-            vk_session = vk_api.VkApi(token=self.token)
-            vk = vk_session.get_api()
-        except Exception as e:
-            self.log_signal.emit(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
-            self.finished_signal.emit()
-            return
-
-        try:
-            server_time = vk.utils.getServerTime()
-            current_time = server_time
-            self.log_signal.emit(
-                f"[⏰] Точное время сервера: {datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M')}"
-            )
-        except:
-            current_time = int(time.time())
-            self.log_signal.emit(
-                f"[🤬WARN] Не удалось получить время сервера. Используется локальное время."
-            )
-
-        delay_between_posts = 3
-        post_delay_seconds = self.interval_hours * 3600
-        current_post_time = self.start_timestamp
+        self.dry_run = dry_run
+        engine_class = PostingEngine
+        if engine == "asyncio":
+            from postal_async import AsyncPostingEngine
+            engine_class = AsyncPostingEngine
+        self.engine = engine_class(
+            *args, log=self.log_signal.emit, on_post_time=self.update_last_post_time.emit, **kwargs
+        )
 
-        photos = [f for f in os.listdir(self.folder_path) if os.path.isfile(os.path.join(self.folder_path, f))]
-        self.log_signal.emit(f"[🔎] Найдено {len(photos)} изображений для публикации.")
+    @property
+    def paused(self):
+        return self.engine.paused
 
-        batch_size = int(self.photos_per_post)
-        batches = [photos[i:i + batch_size] for i in range(0, len(photos), batch_size)]
+    def toggle_pause(self):
+        self.engine.toggle_pause()
 
-        from concurrent.futures import ThreadPoolExecutor
+    def cancel(self):
+        self.engine.cancel()
 
-        for batch_number, photo_batch in enumerate(batches):
-            while self.paused:
-                with self.pause_cond:
-                    self.pause_cond.wait(timeout=1.0)
+    def set_max_uploads(self, max_uploads):
+        self.engine.set_max_uploads(max_uploads)
 
-            try:
-                media_ids = []
-
-                def upload_single_photo(photo_file):
-                    try:
-                        self.log_signal.emit(f"[📩] Загружаю {photo_file}")
-                        full_path = os.path.join(self.folder_path, photo_file)
-                        upload_server = vk.photos.getWallUploadServer(group_id=abs(int(self.group_id)))
-                        server, photo_data, photo_hash = self.upload_photo(upload_server, full_path)
-                        media_id = self.save_wall_photo(vk, self.group_id, server, photo_data, photo_hash)
-                        return media_id
-                    except Exception as e:
-                        self.log_signal.emit(f"[🧰ERROR] Ошибка при загрузке {photo_file}: {e}")
-                        return None
-
-                with ThreadPoolExecutor(max_workers=9) as executor:
-                    results = list(executor.map(upload_single_photo, photo_batch))
-                    media_ids = [result for result in results if result is not None]
-
-                post_time = current_post_time + batch_number * post_delay_seconds
-                if post_time < int(time.time()):
-                    post_time = int(time.time()) + 60 * (batch_number + 1)
-                    self.log_signal.emit(
-                        f"[🤬WARN] Скорректировано время для поста #{batch_number} на {datetime.fromtimestamp(post_time).strftime('%Y-%m-%d %H:%M')}"
-                    )
-                else:
-                    self.log_signal.emit(
-                        f"[📅] Пост #{batch_number} запланирован на {datetime.fromtimestamp(post_time).strftime('%Y-%m-%d %H:%M')}"
-                    )
-
-                post_text = self.caption
-
-                if self.use_random_emoji and self.emoji_list:
-                    emoji = random.choice(self.emoji_list)
-                    post_text += f"\n\n{emoji}"
-
-                vk.wall.post(
-                    owner_id=int(self.group_id),
-                    from_group=1,
-                    message=post_text,
-                    attachments=",".join(media_ids),
-                    publish_date=post_time
-                )
-
-                self.posts_saved += 1
-                self.update_last_post_time.emit(post_time)
-                save_config(self.token, self.group_id, self.photos_per_post, post_time)
-                time.sleep(delay_between_posts)
-
-            except Exception as e:
-                self.log_signal.emit(f"[🧰ERROR] Ошибка при обработке пакета #{batch_number}: {e}")
-
-        self.log_signal.emit("[📝] 🧃 Все посты добавлены в отложку. Можешь пойти пить пиво.🍺")
+    def run(self):
+        if self.dry_run:
+            self.engine.dry_run()
+        else:
+            self.engine.run()
         self.finished_signal.emit()
-    
-    def upload_photo(self, server, photo_path):
-        import requests
-        import json
-        import time
-
-        for attempt in range(3):
-            try:
-                with open(photo_path, 'rb') as f:
-                    files = {'photo': f}
-                    response = requests.post(server['upload_url'], files=files, timeout=10)
-
-                if not response.text:
-                    raise Exception("Получен пустой ответ от сервера")
-
-                try:
-                    result = response.json()
-                except json.JSONDecodeError:
-                    raise Exception(f"Не удалось декодировать JSON: {response.text[:500]}...")
 
-                if "error" in result:
-                    raise Exception(f"Ошибка от ВК: {result['error']}")
 
-                return result['server'], result['photo'], result['hash']
 
-            except Exception as e:
-                self.log_signal.emit(f"[🔄] Ошибка загрузки {photo_path} (попытка {attempt + 1}/3): {e}")
-                if attempt < 2:
-                    time.sleep(2)
-                else:
-                    raise
+class CheckAndClearWorker(QThread):
+    log_signal = Signal(str)
+    finished_signal = Signal()
+    count_ready = Signal(int)
 
-        
-    def save_wall_photo(self, vk, group_id, server, photo_data, photo_hash):
-        photos = vk.photos.saveWallPhoto(
-            group_id=abs(int(group_id)),
-            server=server,
-            photo=photo_data,
-            hash=photo_hash
+    def __init__(self, token, group_id, action="check", session=None):
+        super().__init__()
+        self.engine = CheckAndClearEngine(
+            token, group_id, action, log=self.log_signal.emit, on_count=self.count_ready.emit, session=session
         )
-        return f"photo{photos[0]['owner_id']}_{photos[0]['id']}"
 
-    def upload_single_photo(self, vk, group_id, folder_path, photo_file):
-        try:
-            self.log_signal.emit(f"[📩] Загружаю {photo_file}")
-            full_path = os.path.join(folder_path, photo_file)
-            upload_server = vk.photos.getWallUploadServer(group_id=abs(int(group_id)))
-            server, photo_data, photo_hash = self.upload_photo(upload_server, full_path)
-            media_id = self.save_wall_photo(vk, group_id, server, photo_data, photo_hash)
-            return media_id
-        except Exception as e:
-            self.log_signal.emit(f"[🧰ERROR] Ошибка при загрузке {photo_file}: {e}")
-            return None
+    def run(self):
+        self.engine.run()
+        self.finished_signal.emit()
 
 
 
-class CheckAndClearWorker(QThread):
+class EditPostponedWorker(QThread):
     log_signal = Signal(str)
     finished_signal = Signal()
-    count_ready = Signal(int)
 
-    def __init__(self, token, group_id, action="check"):
+    def __init__(self, token, group_id, **kwargs):
         super().__init__()
-        self.token = token
-        self.group_id = group_id
-        self.action = action  
+        self.engine = EditPostponedEngine(token, group_id, log=self.log_signal.emit, **kwargs)
 
     def run(self):
-        try:
-            self.log_signal.emit("[📶] Подключение к API ВКонтакте...")
-            vk_session = vk_api.VkApi(token=self.token)
-            vk = vk_session.get_api()
-        except Exception as e:
-            self.log_signal.emit(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
-            self.finished_signal.emit()
-            return
-
-        try:
-            self.log_signal.emit("[📝⏰] Получаем список отложенных записей...")
-
-            offset = 0
-            count = 100
-            all_posts = []
-
-            while True:
-                response = vk.wall.get(owner_id=int(self.group_id), filter='postponed', count=count, offset=offset)
-                items = response.get('items', [])
-                if not items:
-                    break
-                all_posts.extend(items)
-                offset += count
-                time.sleep(0.3)
-
-            count_posts = len(all_posts)
-            self.count_ready.emit(count_posts)
-
-            if self.action == "check":
-                self.log_signal.emit(f"[🔎] Найдено {count_posts} отложенных записей.")
-            elif self.action == "clear":
-                self.log_signal.emit(f"[🧼🧼🧼] Начинаю удаление {count_posts} отложенных записей.")
-                for post in all_posts:
-                    try:
-                        vk.wall.delete(owner_id=int(self.group_id), post_id=post['id'])
-                        self.log_signal.emit(f"[🧼] Удалён пост ID={post['id']}")
-                        time.sleep(0.2)
-                    except Exception as e:
-                        self.log_signal.emit(f"[🧰ERROR] Ошибка при удалении поста ID={post['id']}: {e}")
-                self.log_signal.emit(f"[👍] Все {count_posts} отложенных записей удалены.")
-        except Exception as e:
-            self.log_signal.emit(f"[🧰ERROR] Ошибка при работе с API: {e}")
-
+        self.engine.run()
         self.finished_signal.emit()
 
 
 
 class VKAutoPosterApp(QWidget):
+    # Сколько строк лога держать на экране и как часто (мс) выводить накопившиеся.
+    log_limit = 5000
+    log_flush_ms = 100
+
     def __init__(self):
         super().__init__()
+        # ApiSession на каждый введённый токен: соединения, время сервера и данные
+        # сообщества переживают отдельные нажатия кнопок.
+        self.sessions = {}
         self.setWindowTitle("VK Going Auto-Postal!")
         self.resize(900, 550)
         icon_path = resource_path("ico.ico")
@@ -318,7 +126,7 @@ class VKAutoPosterApp(QWidget):
                 padding: 5px;
                 color: white;
             }
-            QTextEdit {
+            QPlainTextEdit {
                 background-color: #1e1e1e;
                 color: #cccccc;
                 border: 1px solid #444;
@@ -338,16 +146,19 @@ class VKAutoPosterApp(QWidget):
             QPushButton#clear_button {
                 background-color: #ff4444;
             }
-            QPushButton#clear_button:hover {
+            QPushButton#clear_button:hover, QPushButton#stop_button:hover {
                 background-color: #cc3333;
             }
+            QPushButton#stop_button {
+                background-color: #ff4444;
+            }
             QPushButton#pause_button {
                 background-color: #ffa500;
             }
             QPushButton#pause_button:hover {
                 background-color: #dd8800;
             }
-            QDateTimeEdit {
+            QDateTimeEdit, QComboBox, QSpinBox {
                 background-color: #444;
                 border: 1px solid #555;
                 padding: 5px;
@@ -366,22 +177,20 @@ class VKAutoPosterApp(QWidget):
                 background-color: #cc3333;
             }
         """)
+        self.log_lines = deque(maxlen=self.log_limit)
+        self.pending_logs = deque()
+        self.log_file = None
         self.init_ui()
         
-        self.emoji_list = [
-            "💋", "💄", "🧴", "🧼", "🧖‍♀️", "✨", "🌟", "💫", "💅", "💎", "🌸",
-            "👠", "👡", "👢", "👜", "👛", "👒", "🎀", "🧥", "🩱", "👗", "👚", "🕶️",
-            "💘", "💗", "💓", "💞", "❤️", "💌", "🌹", "💋", "😏", "😍", "😘", "🥰",
-            "🎉", "✨", "🍾", "🥂", "🍷", "🍸", "🍹",
-            "🧁", "🍰", "🍭", "🍬", "🍫", "🍩", "🍪", "🍧", "🍨", "🍦", "🧁",
-            "🧚", "🦄", "🧸", "🎀", "🔮", "🌌", "🪐", "💫", "🌠",
-            "😈", "👅", "🍑", "🍒", "🍓", "🥵", "👙", "🩳", "💦", "🩸",
-            "😳", "😍", "🤤", "😜", "😏", "😒", "😌", "🥰", "😱", "🤯", "😵‍💫",
-            "🐾", "🌷", "🌼", "🌻", "🌿", "🍀", "🍁", "🥀", "🌺",
-            "🌌", "🪐", "🌕", "🌑", "🛸", "👽", "👾", "🛰️",
-            "☕", "🍵", "🥛", "🍯", "🧁", "🍰", "🍩", "🍪", "🍧", "🍨", "🍦",
-            "🎵", "🎶", "🎧", "📻", "🎹", "🎼", "🎤", "🎙️", "🎚️", "📼",
-        ]
+        self.emoji_list = list(EMOJI_LIST)
+
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_logs)
+        self.log_timer.start(self.log_flush_ms)
+
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.refresh_metrics)
+        self.metrics_timer.start(1000)
 
     def init_ui(self):
         main_layout = QHBoxLayout()
@@ -406,6 +215,15 @@ class VKAutoPosterApp(QWidget):
         left_layout.addWidget(self.photos_per_post_input)
 
         
+        self.photo_order_input = QComboBox()
+        self.photo_order_input.addItem("По имени", "name")
+        self.photo_order_input.addItem("По имени, числа по порядку (2 < 10)", "natural")
+        self.photo_order_input.addItem("По дате изменения", "mtime")
+        self.photo_order_input.addItem("Как лежат в папке (быстрее)", "none")
+        left_layout.addWidget(QLabel("Порядок фото:"))
+        left_layout.addWidget(self.photo_order_input)
+
+        
         self.interval_input = QLineEdit("2")
         left_layout.addWidget(QLabel("Интервал постов (в часах):"))
         left_layout.addWidget(self.interval_input)
@@ -428,11 +246,38 @@ class VKAutoPosterApp(QWidget):
         self.random_emoji_checkbox = QCheckBox("Рандомизировать эмодзи")
         left_layout.addWidget(self.random_emoji_checkbox)
 
+        self.preprocess_checkbox = QCheckBox("Сжимать фото до 2560px перед загрузкой")
+        left_layout.addWidget(self.preprocess_checkbox)
+
+        self.async_engine_checkbox = QCheckBox("asyncio-движок загрузки (нужен aiohttp)")
+        left_layout.addWidget(self.async_engine_checkbox)
+
+        self.album_input = QLineEdit("")
+        self.album_input.setPlaceholderText("пусто - загрузка прямо на стену")
+        left_layout.addWidget(QLabel("ID альбома сообщества (по 5 фото за запрос, необязательно):"))
+        left_layout.addWidget(self.album_input)
+
         
+        left_layout.addWidget(QLabel("Макс. одновременных загрузок (лимит подбирается сам):"))
+        self.max_uploads_input = QSpinBox()
+        self.max_uploads_input.setRange(1, PostingEngine.max_upload_workers)
+        self.max_uploads_input.setValue(PostingEngine.upload_workers)
+        self.max_uploads_input.valueChanged.connect(self.change_max_uploads)
+        left_layout.addWidget(self.max_uploads_input)
+        self.async_engine_checkbox.toggled.connect(self.change_engine)
+
         self.run_button = QPushButton("GO POSTAL!")
-        self.run_button.clicked.connect(self.start_posting)
+        self.run_button.clicked.connect(lambda: self.start_posting())
         left_layout.addWidget(self.run_button)
 
+        self.dead_letters_button = QPushButton("Повторить неудавшиеся фото")
+        self.dead_letters_button.clicked.connect(lambda: self.start_posting(dead_letters=True))
+        left_layout.addWidget(self.dead_letters_button)
+
+        self.dry_run_button = QPushButton("🧪Оценить без загрузки")
+        self.dry_run_button.clicked.connect(lambda: self.start_posting(dry_run=True))
+        left_layout.addWidget(self.dry_run_button)
+
         
         check_clear_layout = QHBoxLayout()
         self.check_button = QPushButton("Проверить кол-во отложки")
@@ -445,11 +290,35 @@ class VKAutoPosterApp(QWidget):
         left_layout.addLayout(check_clear_layout)
 
         
+        edit_layout = QHBoxLayout()
+        edit_layout.addWidget(QLabel("Сдвиг (ч):"))
+        self.shift_input = QLineEdit("0")
+        self.shift_input.setMaximumWidth(50)
+        edit_layout.addWidget(self.shift_input)
+        self.respace_checkbox = QCheckBox("Интервал и дата выше")
+        self.respace_checkbox.setToolTip("Разложить отложку заново с интервалом выше, начиная с даты первого поста")
+        edit_layout.addWidget(self.respace_checkbox)
+        self.recaption_checkbox = QCheckBox("Подпись выше")
+        self.recaption_checkbox.setToolTip("Заменить подпись всех отложенных записей на подпись выше")
+        edit_layout.addWidget(self.recaption_checkbox)
+        left_layout.addLayout(edit_layout)
+        self.edit_button = QPushButton("✏️Изменить отложку")
+        self.edit_button.clicked.connect(self.edit_delayed)
+        left_layout.addWidget(self.edit_button)
+
+        
         self.pause_button = QPushButton("⏸️Пауза")
         self.pause_button.setObjectName("pause_button")
         self.pause_button.clicked.connect(self.toggle_pause)
         self.pause_button.setEnabled(False)
-        left_layout.addWidget(self.pause_button)
+        self.stop_button = QPushButton("⏹️Стоп")
+        self.stop_button.setObjectName("stop_button")
+        self.stop_button.clicked.connect(self.stop_posting)
+        self.stop_button.setEnabled(False)
+        pause_stop_layout = QHBoxLayout()
+        pause_stop_layout.addWidget(self.pause_button)
+        pause_stop_layout.addWidget(self.stop_button)
+        left_layout.addLayout(pause_stop_layout)
 
         
         self.logo_label = QLabel()
@@ -465,16 +334,39 @@ class VKAutoPosterApp(QWidget):
         left_widget.setLayout(left_layout)
 
         
-        self.log_area = QTextEdit()
+        log_widget = QWidget()
+        log_layout = QVBoxLayout()
+        log_layout.setContentsMargins(0, 0, 0, 0)
+        log_controls = QHBoxLayout()
+        self.log_level_input = QComboBox()
+        self.log_level_input.addItem("Все сообщения", "info")
+        self.log_level_input.addItem("Предупреждения и ошибки", "warning")
+        self.log_level_input.addItem("Только ошибки", "error")
+        self.log_level_input.currentIndexChanged.connect(self.refilter_logs)
+        self.log_file_checkbox = QCheckBox("Писать лог в postal_log.jsonl")
+        self.log_file_checkbox.toggled.connect(self.toggle_log_file)
+        log_controls.addWidget(self.log_level_input)
+        log_controls.addWidget(self.log_file_checkbox)
+        log_controls.addStretch()
+        log_layout.addLayout(log_controls)
+        self.metrics_label = QLabel("")
+        self.metrics_label.setWordWrap(True)
+        log_layout.addWidget(self.metrics_label)
+
+        self.log_area = QPlainTextEdit()
         self.log_area.setReadOnly(True)
+        self.log_area.setMaximumBlockCount(self.log_limit)
+        log_layout.addWidget(self.log_area)
+        log_widget.setLayout(log_layout)
+
         splitter = QSplitter(Qt.Horizontal)
         splitter.addWidget(left_widget)
-        splitter.addWidget(self.log_area)
+        splitter.addWidget(log_widget)
         main_layout = QVBoxLayout()
         main_layout.addWidget(splitter)
         self.setLayout(main_layout)
 
-    def start_posting(self):
+    def start_posting(self, dead_letters=False, dry_run=False):
         token = self.token_input.text().strip()
         group_id = self.group_input.text().strip()
         photos_per_post = self.photos_per_post_input.text().strip()
@@ -495,7 +387,7 @@ class VKAutoPosterApp(QWidget):
             QMessageBox.critical(self, "Ошибка", f"Некорректное число фото на пост: {e}")
             return
 
-        if not token or not group_id:
+        if not group_id or (not token and not dry_run):
             QMessageBox.critical(self, "Ошибка", "Заполни все поля.")
             return
 
@@ -509,6 +401,11 @@ class VKAutoPosterApp(QWidget):
             QMessageBox.critical(self, "Ошибка", "ID должно быть числом.")
             return
 
+        album_id = self.album_input.text().strip() or None
+        if album_id is not None and not album_id.isdigit():
+            QMessageBox.critical(self, "Ошибка", "ID альбома должно быть числом.")
+            return
+
         folder_path = os.path.join(os.path.dirname(sys.argv[0]), "photos")
         if not os.path.exists(folder_path):
             QMessageBox.critical(self, "Ошибка", f'Папка "{folder_path}" не найдена.')
@@ -529,20 +426,34 @@ class VKAutoPosterApp(QWidget):
             else:
                 start_timestamp = int(time.time())
 
-        save_config(token, group_id, photos_per_post, None)
+        if not dry_run:
+            save_config(token, group_id, photos_per_post, None)
 
         self.run_button.setEnabled(False)
-        self.pause_button.setEnabled(True)
+        self.dead_letters_button.setEnabled(False)
+        self.dry_run_button.setEnabled(False)
+        self.pause_button.setEnabled(not dry_run)
+        self.stop_button.setEnabled(not dry_run)
         caption = self.caption_input.text().strip()
         use_random_emoji = self.random_emoji_checkbox.isChecked()
 
         self.worker = PosterWorker(
             token, group_id, interval_hours, folder_path, start_timestamp,
-            photos_per_post, caption, use_random_emoji, self.emoji_list
+            photos_per_post, caption, use_random_emoji, self.emoji_list,
+            self.photo_order_input.currentData(), self.preprocess_checkbox.isChecked(),
+            max_uploads=self.max_uploads_input.value(),
+            dead_letters=dead_letters,
+            album_id=album_id,
+            session=None if dry_run else self.api_session(token),
+            engine="asyncio" if self.async_engine_checkbox.isChecked() else "threads",
+            dry_run=dry_run
         )
-        self.worker.log_signal.connect(self.append_log)
+        self.worker.log_signal.connect(self.append_log, Qt.DirectConnection)
         self.worker.finished_signal.connect(lambda: self.run_button.setEnabled(True))
+        self.worker.finished_signal.connect(lambda: self.dead_letters_button.setEnabled(True))
+        self.worker.finished_signal.connect(lambda: self.dry_run_button.setEnabled(True))
         self.worker.finished_signal.connect(lambda: self.pause_button.setEnabled(False))
+        self.worker.finished_signal.connect(lambda: self.stop_button.setEnabled(False))
         self.worker.update_last_post_time.connect(lambda t: self.datetime_edit.setDateTime(
             datetime.fromtimestamp(t + 7200)
         ))
@@ -563,8 +474,8 @@ class VKAutoPosterApp(QWidget):
             QMessageBox.critical(self, "Ошибка", "ID должно быть числом.")
             return
         self.check_button.setEnabled(False)
-        self.check_worker = CheckAndClearWorker(token, group_id, action="check")
-        self.check_worker.log_signal.connect(self.append_log)
+        self.check_worker = CheckAndClearWorker(token, group_id, action="check", session=self.api_session(token))
+        self.check_worker.log_signal.connect(self.append_log, Qt.DirectConnection)
         self.check_worker.finished_signal.connect(lambda: self.check_button.setEnabled(True))
         self.check_worker.start()
 
@@ -583,11 +494,50 @@ class VKAutoPosterApp(QWidget):
             QMessageBox.critical(self, "Ошибка", "ID должно быть числом.")
             return
         self.clear_button.setEnabled(False)
-        self.clear_worker = CheckAndClearWorker(token, group_id, action="clear")
-        self.clear_worker.log_signal.connect(self.append_log)
+        self.clear_worker = CheckAndClearWorker(token, group_id, action="clear", session=self.api_session(token))
+        self.clear_worker.log_signal.connect(self.append_log, Qt.DirectConnection)
         self.clear_worker.finished_signal.connect(lambda: self.clear_button.setEnabled(True))
         self.clear_worker.start()
 
+    def edit_delayed(self):
+        token = self.token_input.text().strip()
+        group_id = self.group_input.text().strip()
+        if not token or not group_id:
+            QMessageBox.critical(self, "Ошибка", "Заполните оба поля.")
+            return
+        try:
+            group_id_int = int(group_id)
+            if group_id_int > 0:
+                group_id_int = -group_id_int
+            group_id = str(group_id_int)
+        except ValueError:
+            QMessageBox.critical(self, "Ошибка", "ID должно быть числом.")
+            return
+        try:
+            shift_hours = float(self.shift_input.text().strip().replace(",", ".") or 0)
+            interval_hours = int(self.interval_input.text().strip()) if self.respace_checkbox.isChecked() else None
+            if interval_hours is not None and interval_hours < 1:
+                raise ValueError("Интервал должен быть больше или равен 1")
+        except ValueError as e:
+            QMessageBox.critical(self, "Ошибка", f"Некорректный сдвиг или интервал: {e}")
+            return
+        if not shift_hours and interval_hours is None and not self.recaption_checkbox.isChecked():
+            QMessageBox.critical(self, "Ошибка", "Укажите сдвиг или отметьте, что менять.")
+            return
+
+        self.edit_button.setEnabled(False)
+        self.edit_worker = EditPostponedWorker(
+            token, group_id,
+            shift=int(shift_hours * 3600),
+            interval=interval_hours * 3600 if interval_hours else None,
+            start=int(self.datetime_edit.dateTime().toSecsSinceEpoch()) if interval_hours else None,
+            caption=self.caption_input.text() if self.recaption_checkbox.isChecked() else None,
+            session=self.api_session(token),
+        )
+        self.edit_worker.log_signal.connect(self.append_log, Qt.DirectConnection)
+        self.edit_worker.finished_signal.connect(lambda: self.edit_button.setEnabled(True))
+        self.edit_worker.start()
+
     def toggle_pause(self):
         if hasattr(self, 'worker'):
             self.worker.toggle_pause()
@@ -604,13 +554,113 @@ class VKAutoPosterApp(QWidget):
             else:
                 self.append_log("[▶️] Продолжаю работу...")
 
+    def stop_posting(self):
+        if hasattr(self, 'worker') and self.worker.isRunning():
+            self.worker.cancel()
+            self.stop_button.setEnabled(False)
+            self.append_log("[⏹️] Останавливаю: новые загрузки не начинаются, текущие доделываются...")
+
+    def change_engine(self, use_async):
+        # У asyncio-движка загрузки - корутины, поэтому и потолок у него выше.
+        engine_class = PostingEngine
+        if use_async:
+            from postal_async import AsyncPostingEngine
+            engine_class = AsyncPostingEngine
+        self.max_uploads_input.setRange(1, engine_class.max_upload_workers)
+        self.max_uploads_input.setValue(engine_class.upload_workers)
+
+    def change_max_uploads(self, value):
+        if hasattr(self, 'worker') and self.worker.isRunning():
+            self.worker.set_max_uploads(value)
+
     @Slot(str)
     def append_log(self, text):
-        self.log_area.append(text)
+        # Вызывается напрямую из рабочих потоков (DirectConnection): только кладём в очередь,
+        # а на экран всё накопившееся выводит flush_logs по таймеру одним куском.
+        self.pending_logs.append(text)
+
+    def flush_logs(self):
+        if not self.pending_logs:
+            return
+        batch = []
+        while self.pending_logs:
+            batch.append(self.pending_logs.popleft())
+        if self.log_file is not None:
+            for text in batch:
+                self.log_file.write(text)
+            self.log_file.flush()
+
+        min_level = LOG_LEVELS[self.log_level_input.currentData()]
+        visible = []
+        for text in batch:
+            level = LOG_LEVELS[log_level(text)]
+            self.log_lines.append((level, text))
+            if level >= min_level:
+                visible.append(text)
+        if visible:
+            self.log_area.appendPlainText("\n".join(visible[-self.log_limit:]))
+
+    def refresh_metrics(self):
+        # Живая сводка по текущему (или последнему) запуску.
+        workers = [getattr(self, name, None) for name in ("worker", "clear_worker", "check_worker", "edit_worker")]
+        workers = [worker for worker in workers if worker is not None]
+        running = [worker for worker in workers if worker.isRunning()]
+        if not workers:
+            return
+        worker = (running or workers)[0]
+        snapshot = worker.engine.metrics.snapshot()
+        counters = snapshot["counters"]
+        stages = snapshot["stages"]
+        parts = [
+            f"📊 {snapshot['photos_per_minute']:.1f} фото/мин",
+            f"{snapshot['posts_per_minute']:.1f} постов/мин",
+            f"{counters.get('upload_bytes', 0) / (1024 * 1024):.1f} МБ",
+        ]
+        for stage, title in (("upload", "загрузка"), ("api:execute", "execute"), ("api:wall.post", "wall.post")):
+            if stage in stages:
+                parts.append(f"{title} p50 {stages[stage]['p50']:.2f} / p95 {stages[stage]['p95']:.2f} с")
+        retries = sum(value for key, value in counters.items() if key.startswith("retries"))
+        errors = sum(value for key, value in counters.items() if key.startswith(("errors", "api_errors")))
+        parts.append(f"повторов {retries}, ошибок {errors}")
+        controller = getattr(worker.engine, "upload_controller", None)
+        if controller is not None and worker.isRunning():
+            state = controller.state()
+            parts.append(f"загрузок {state['in_flight']}/{state['limit']} (макс. {state['max_limit']})")
+        self.metrics_label.setText(" · ".join(parts))
+
+    def refilter_logs(self):
+        min_level = LOG_LEVELS[self.log_level_input.currentData()]
+        self.log_area.setPlainText("\n".join(text for level, text in self.log_lines if level >= min_level))
+        self.log_area.moveCursor(QtGui.QTextCursor.End)
+
+    def toggle_log_file(self, enabled):
+        if enabled:
+            try:
+                self.log_file = JsonLogFile(LOG_PATH)
+            except OSError as e:
+                self.log_file_checkbox.setChecked(False)
+                self.append_log(f"[🧰ERROR] Не удалось открыть файл лога: {e}")
+        elif self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+
+    def api_session(self, token):
+        if token not in self.sessions:
+            self.sessions[token] = ApiSession(token)
+        return self.sessions[token]
+
+    def closeEvent(self, event):
+        for session in self.sessions.values():
+            session.close()
+        self.flush_logs()
+        if self.log_file is not None:
+            self.log_file.close()
+        super().closeEvent(event)
 
 
 if __name__ == "__main__":
     import traceback
+    multiprocessing.freeze_support()
     try:
         app = QApplication(sys.argv)
         window = VKAutoPosterApp()
@@ -0,0 +1,311 @@
+"""Локальная замена API ВКонтакте и сервера загрузки фото для бенчмарков.
+
+Реализует utils.getServerTime, groups.getById, photos.getWallUploadServer,
+photos.saveWallPhoto, photos.getUploadServer, photos.save (загрузка в альбом),
+wall.post, wall.get (filter=postponed), wall.edit, wall.delete, execute и адрес
+загрузки фото. Задержку, долю ошибок и лимит запросов в секунду можно настроить.
+
+Отдельный запуск: python bench/mock_vk.py --port 8080 --latency 0.05
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+TOO_MANY_RPS = {"error_code": 6, "error_msg": "Too many requests per second"}
+INTERNAL_ERROR = {"error_code": 10, "error_msg": "Internal server error"}
+
+
+class MockVk:
+    """
+    latency - задержка ответа API (секунды), upload_latency - сервера загрузки;
+    error_rate - доля вызовов API с ошибкой 10, upload_error_rate - доля
+    загрузок с HTTP 500; rate_limit - сколько запросов в секунду на токен
+    пропускать, остальные получают ошибку 6 (как у ВК, execute считается за один).
+    """
+
+    def __init__(self, latency=0.0, upload_latency=0.0, error_rate=0.0, upload_error_rate=0.0,
+                 rate_limit=None, owner_id=-1, seed=None):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.error_rate = error_rate
+        self.upload_error_rate = upload_error_rate
+        self.rate_limit = rate_limit
+        self.owner_id = owner_id
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.requests = {}
+        self.posts = {}
+        self.guids = {}
+        self.next_id = 1
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def api_url(self):
+        return self.url + "/method/"
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "errors": dict(self.errors),
+                "uploads": self.uploads,
+                "upload_bytes": self.upload_bytes,
+                "posts": len(self.posts),
+            }
+
+    def new_id(self):
+        with self.lock:
+            value = self.next_id
+            self.next_id += 1
+            return value
+
+    def over_limit(self, token):
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = self.requests.setdefault(token, deque())
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.rate_limit:
+                return True
+            window.append(now)
+            return False
+
+    def api(self, method, params):
+        with self.lock:
+            self.calls[method] += 1
+        if self.over_limit(params.get("access_token", "")):
+            with self.lock:
+                self.errors[6] += 1
+            return {"error": TOO_MANY_RPS}
+        if method == "execute":
+            return self.execute(params["code"])
+        return self.call(method, params)
+
+    def call(self, method, params):
+        if self.error_rate and self.random.random() < self.error_rate:
+            with self.lock:
+                self.errors[10] += 1
+            return {"error": INTERNAL_ERROR}
+        handler = getattr(self, "method_" + method.replace(".", "_"), None)
+        if handler is None:
+            return {"error": {"error_code": 3, "error_msg": f"Unknown method passed: {method}"}}
+        return handler(params)
+
+    def execute(self, code):
+        # Понимает только код вида "return [API.method({...}), ...];", который строит VkExecuteBatch.
+        decoder = json.JSONDecoder()
+        values = []
+        errors = []
+        for match in re.finditer(r"API\.([\w.]+)\(", code):
+            method = match.group(1)
+            params, _ = decoder.raw_decode(code, match.end())
+            with self.lock:
+                self.calls[method] += 1
+            response = self.call(method, {key: str(value) for key, value in params.items()})
+            if "error" in response:
+                values.append(False)
+                errors.append({"method": method, **response["error"]})
+            else:
+                values.append(response["response"])
+        result = {"response": values}
+        if errors:
+            result["execute_errors"] = errors
+        return result
+
+    def method_utils_getServerTime(self, params):
+        return {"response": int(time.time())}
+
+    def method_groups_getById(self, params):
+        group_id = abs(int(params.get("group_id") or -self.owner_id))
+        return {"response": [{"id": group_id, "name": f"Mock group {group_id}", "screen_name": f"club{group_id}"}]}
+
+    def method_photos_getWallUploadServer(self, params):
+        return {"response": {"upload_url": self.url + "/upload", "album_id": -14, "user_id": 0}}
+
+    def method_photos_saveWallPhoto(self, params):
+        if not params.get("photo") or not params.get("hash"):
+            return {"error": {"error_code": 100, "error_msg": "One of the parameters specified was missing or invalid"}}
+        return {"response": [{"owner_id": self.owner_id, "id": self.new_id()}]}
+
+    def method_photos_getUploadServer(self, params):
+        return {"response": {"upload_url": self.url + "/upload_album", "album_id": int(params["album_id"]), "user_id": 0}}
+
+    def method_photos_save(self, params):
+        if not params.get("photos_list") or not params.get("hash"):
+            return {"error": {"error_code": 100, "error_msg": "One of the parameters specified was missing or invalid"}}
+        return {"response": [
+            {"owner_id": self.owner_id, "id": self.new_id(), "album_id": int(params["album_id"])}
+            for _ in json.loads(params["photos_list"])
+        ]}
+
+    def method_wall_post(self, params):
+        # Как у ВК: повтор с тем же guid возвращает уже созданный пост.
+        guid = params.get("guid")
+        with self.lock:
+            if guid and guid in self.guids:
+                return {"response": {"post_id": self.guids[guid]}}
+        post_id = self.new_id()
+        with self.lock:
+            if guid:
+                self.guids[guid] = post_id
+            self.posts[post_id] = {
+                "id": post_id,
+                "date": int(params.get("publish_date") or time.time()),
+                "text": params.get("message", ""),
+                "attachments": params.get("attachments", ""),
+            }
+        return {"response": {"post_id": post_id}}
+
+    def method_wall_edit(self, params):
+        post_id = int(params["post_id"])
+        with self.lock:
+            post = self.posts.get(post_id)
+            if post is None:
+                return {"error": {"error_code": 100, "error_msg": "post not found"}}
+            if "publish_date" in params:
+                post["date"] = int(params["publish_date"])
+            if "message" in params:
+                post["text"] = params["message"]
+            if "attachments" in params:
+                post["attachments"] = params["attachments"]
+        return {"response": {"post_id": post_id}}
+
+    def method_wall_get(self, params):
+        offset = int(params.get("offset", 0))
+        count = min(int(params.get("count", 20)), 100)
+        with self.lock:
+            posts = sorted(self.posts.values(), key=lambda post: post["date"])
+            items = [self.wall_item(post) for post in posts[offset:offset + count]]
+            return {"response": {"count": len(posts), "items": items}}
+
+    def wall_item(self, post):
+        attachments = []
+        for media_id in filter(None, post["attachments"].split(",")):
+            kind, owner_id, item_id = re.match(r"([a-z]+)(-?\d+)_(\d+)", media_id).groups()
+            attachments.append({"type": kind, kind: {"owner_id": int(owner_id), "id": int(item_id)}})
+        return {"id": post["id"], "date": post["date"], "text": post["text"], "attachments": attachments}
+
+    def method_wall_delete(self, params):
+        with self.lock:
+            if self.posts.pop(int(params["post_id"]), None) is None:
+                return {"error": {"error_code": 100, "error_msg": "post not found"}}
+        return {"response": 1}
+
+    def upload(self, body, album=False):
+        with self.lock:
+            self.uploads += 1
+            self.upload_bytes += len(body)
+        if self.upload_error_rate and self.random.random() < self.upload_error_rate:
+            with self.lock:
+                self.errors["upload"] += 1
+            return None
+        photos = body.count(b"filename=")
+        uploaded = json.dumps([{"photo": f"mock{self.uploads}", "sizes": []}] * max(photos, 1))
+        if album:
+            return {"server": 1, "photos_list": uploaded, "aid": 1, "hash": f"{self.uploads:032x}"}
+        return {"server": 1, "photo": uploaded, "hash": f"{self.uploads:032x}"}
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_body(self):
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    chunks = []
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                        if not size:
+                            self.rfile.readline()
+                            return b"".join(chunks)
+                        chunks.append(self.rfile.read(size))
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def send(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.read_body()
+                path = urlparse(self.path).path
+                if path in ("/upload", "/upload_album"):
+                    time.sleep(mock.upload_latency)
+                    result = mock.upload(body, album=path == "/upload_album")
+                    if result is None:
+                        self.send(500, {"error": "mock upload error"})
+                    else:
+                        self.send(200, result)
+                    return
+                if not path.startswith("/method/"):
+                    self.send(404, {"error": "not found"})
+                    return
+                time.sleep(mock.latency)
+                params = {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+                self.send(200, mock.api(path[len("/method/"):], params))
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mock VK API для бенчмарков")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--upload-latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--upload-error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, help="Запросов в секунду на токен (по умолчанию без лимита)")
+    args = parser.parse_args(argv)
+
+    mock = MockVk(args.latency, args.upload_latency, args.error_rate, args.upload_error_rate, args.rate_limit)
+    mock.start(args.port)
+    print(f"Mock VK API: {mock.api_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(json.dumps(mock.stats(), ensure_ascii=False))
+        mock.stop()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""Бенчмарк конвейера постинга на локальном mock-сервере (bench/mock_vk.py).
+
+Каждый сценарий идёт в отдельном процессе, со своей временной папкой для фото,
+журнала, кэша и индекса, и пишет фото/с и пиковую память процесса.
+
+    python bench/run_bench.py                         # быстрые сценарии 1k
+    python bench/run_bench.py --scenario 10k-9 --engine asyncio
+    python bench/run_bench.py --output results.jsonl --baseline baseline.json
+
+С --baseline код выхода 1, если фото/с упали больше чем на --tolerance.
+Код выхода 1 и тогда, когда часть пакетов сценария не поместилась в отложку:
+такой замер не соответствует своему имени.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from mock_vk import MockVk
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# имя: (кол-во фото, фото на пост)
+SCENARIOS = {
+    "1k-1": (1000, 1),
+    "1k-9": (1000, 9),
+    "10k-1": (10000, 1),
+    "10k-9": (10000, 9),
+}
+QUICK_SCENARIOS = ("1k-1", "1k-9")
+
+
+def make_photos(folder, count, size):
+    # Содержимое случайное: mock его не разбирает, а одинаковые файлы отсеялись бы как дубликаты.
+    os.makedirs(folder)
+    for number in range(count):
+        with open(os.path.join(folder, f"photo_{number:06d}.jpg"), "wb") as f:
+            f.write(os.urandom(size))
+
+
+def peak_memory_mb():
+    if resource is None:
+        # Windows: только память Python-объектов, без учёта самого интерпретатора.
+        import tracemalloc
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в Linux в килобайтах, в macOS - в байтах.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(name, photos, photos_per_post, api_url, engine, workdir):
+    # Выполняется в отдельном процессе. Все файлы postal_core (конфиг, журнал,
+    # кэш, индекс, метрики) лежат рядом с sys.argv[0], поэтому подменяем его до импорта.
+    sys.argv[0] = os.path.join(workdir, "bench")
+    sys.path.insert(0, ROOT)
+    if resource is None:
+        import tracemalloc
+        tracemalloc.start()
+
+    import postal_core
+    postal_core.HttpPool.api_url = api_url
+    # Mock не ограничивает размер отложки, а 10k-1 - это 10000 постов: без этого
+    # SlotAllocator спланировал бы только queue_cap из них.
+    postal_core.SlotAllocator.queue_cap = photos + 1
+    engine_class = postal_core.PostingEngine
+    if engine == "asyncio":
+        from postal_async import AsyncPostingEngine
+        AsyncPostingEngine.api_url = api_url
+        engine_class = AsyncPostingEngine
+
+    engine = engine_class(
+        f"bench-{name}", "-1", 1, os.path.join(workdir, "photos"), int(time.time()) + 3600, str(photos_per_post)
+    )
+    started = time.perf_counter()
+    result = engine.run()
+    elapsed = time.perf_counter() - started
+
+    snapshot = engine.metrics.snapshot()
+    posted = snapshot["counters"].get("photos", 0)
+    return {
+        "status": result["status"],
+        "photos": posted,
+        "posts": result["posts"],
+        "failed": result["failed"],
+        "unplanned": result.get("unplanned", 0),
+        "seconds": round(elapsed, 2),
+        "photos_per_sec": round(posted / elapsed, 2),
+        "peak_memory_mb": round(peak_memory_mb(), 1),
+        "stages": {
+            stage: {key: stats[key] for key in ("count", "avg", "p50", "p95")}
+            for stage, stats in snapshot["stages"].items()
+        },
+    }
+
+
+def bench(name, args):
+    photos, photos_per_post = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix=f"postal_bench_{name}_")
+    mock = MockVk(
+        args.latency, args.upload_latency, args.error_rate, args.upload_error_rate, args.rate_limit, seed=1
+    ).start()
+    try:
+        make_photos(os.path.join(workdir, "photos"), photos, args.photo_size)
+        # spawn - чтобы пиковая память считалась только для сценария, без памяти этого процесса.
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1) as pool:
+            result = pool.apply(run_scenario, (name, photos, photos_per_post, mock.api_url, args.engine, workdir))
+        result.update(scenario=name, engine=args.engine, mock=mock.stats())
+        return result
+    finally:
+        mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def check_baseline(results, path, tolerance):
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = {}
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                baseline[(record["scenario"], record["engine"])] = record
+
+    regressions = []
+    for result in results:
+        reference = baseline.get((result["scenario"], result["engine"]))
+        if reference is None:
+            continue
+        if result["photos_per_sec"] < reference["photos_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{result['scenario']}/{result['engine']}: {result['photos_per_sec']} фото/с "
+                f"против {reference['photos_per_sec']} в {path}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк VK Going Auto-Postal на mock-сервере")
+    parser.add_argument("--scenario", action="append", choices=tuple(SCENARIOS),
+                        help="Можно указать несколько раз (по умолчанию: " + ", ".join(QUICK_SCENARIOS) + ")")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--photo-size", type=int, default=200 * 1024, help="Размер одного фото в байтах")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответа API, с")
+    parser.add_argument("--upload-latency", type=float, default=0.2, help="Задержка сервера загрузки, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля вызовов API с ошибкой")
+    parser.add_argument("--upload-error-rate", type=float, default=0.0, help="Доля загрузок с HTTP 500")
+    parser.add_argument("--rate-limit", type=int, help="Лимит запросов в секунду на токен (ошибка 6 сверх него)")
+    parser.add_argument("--output", help="Дописать результаты в JSON-lines файл")
+    parser.add_argument("--baseline", help="JSON-lines файл с прошлыми результатами для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое падение фото/с (доля)")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenario or QUICK_SCENARIOS:
+        result = bench(name, args)
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+        print(
+            f"{name} ({args.engine}): {result['photos_per_sec']} фото/с, {result['seconds']} с, "
+            f"пик памяти {result['peak_memory_mb']} МБ, статус {result['status']}",
+            file=sys.stderr
+        )
+
+    incomplete = [result for result in results if result["unplanned"]]
+    for result in incomplete:
+        print(
+            f"Неполный прогон: {result['scenario']}/{result['engine']} - {result['unplanned']} постов "
+            f"не поместились в отложку, запощено {result['photos']} из {SCENARIOS[result['scenario']][0]} фото",
+            file=sys.stderr
+        )
+
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Регрессия: {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 1 if incomplete else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
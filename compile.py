@@ -39,6 +39,10 @@ command = [
     '--hidden-import=requests',
     '--hidden-import=concurrent.futures',
     '--hidden-import=concurrent.futures.thread',
+    '--hidden-import=concurrent.futures.process',
+    '--hidden-import=PIL.Image',
+    '--hidden-import=postal_async',
+    '--hidden-import=aiohttp',
     '--hidden-import=pkg_resources',
     '--hidden-import=random',
     script_path
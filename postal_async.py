@@ -0,0 +1,386 @@
+import os
+import time
+import asyncio
+from collections import deque
+from contextlib import ExitStack, asynccontextmanager
+from datetime import datetime
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from postal_core import (
+    PostingEngine, VkExecuteBatch, Metrics, RetryPolicy, UploadCancelled, UploadQueue, get_rate_limiter, log_group,
+    API_URL, API_VERSION, TOO_MANY_RPS_CODE, RATE_ERROR_CODES
+)
+
+
+class AsyncApiError(Exception):
+
+    def __init__(self, error):
+        super().__init__(error.get("error_msg", ""))
+        self.code = error.get("error_code")
+        self.error = error
+
+    def __str__(self):
+        return f"[{self.code}] {self.error.get('error_msg', '')}"
+
+
+class AsyncVkApi:
+    # Минимальный клиент VK API поверх aiohttp, с тем же RateLimiter, что и у LimitedVkApi.
+
+    def __init__(self, http, token, limiter, api_url=API_URL, metrics=None):
+        self.http = http
+        self.token = token
+        self.limiter = limiter
+        self.api_url = api_url
+        self.metrics = metrics or Metrics()
+
+    async def method(self, method, values=None, raw=False):
+        data = {key: str(value) for key, value in (values or {}).items()}
+        data["access_token"] = self.token
+        data["v"] = API_VERSION
+        while True:
+            delay = self.limiter.reserve()
+            self.metrics.observe("rate_wait", delay)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            with self.metrics.timer(f"api:{method}"):
+                async with self.http.post(self.api_url + method, data=data) as response:
+                    response.raise_for_status()
+                    result = await response.json(content_type=None)
+
+            error = result.get("error")
+            if error is None:
+                self.limiter.on_success()
+                return result if raw else result["response"]
+            self.metrics.inc("api_errors", method=method, code=error.get("error_code"))
+            if error.get("error_code") == TOO_MANY_RPS_CODE:
+                self.metrics.inc("retries", stage="api")
+            if error.get("error_code") in RATE_ERROR_CODES:
+                self.limiter.on_rate_error(error["error_code"])
+            if error.get("error_code") != TOO_MANY_RPS_CODE:
+                raise AsyncApiError(error)
+
+
+class AsyncRetryPolicy(RetryPolicy):
+    # Обрывы соединения и таймауты aiohttp тоже временные (ответы 429/5xx RetryPolicy узнаёт по статусу).
+    TRANSIENT_ERRORS = RetryPolicy.TRANSIENT_ERRORS + ((aiohttp.ClientError,) if aiohttp is not None else ())
+
+
+class AsyncWallBridge:
+    # vk.wall.get(...) для синхронного кода (PostponedIndex.sync) в отдельном потоке:
+    # сам вызов выполняется в цикле событий через AsyncVkApi.
+
+    def __init__(self, api, loop):
+        self.api = api
+        self.loop = loop
+        self.wall = self
+
+    def get(self, **params):
+        return asyncio.run_coroutine_threadsafe(self.api.method("wall.get", params), self.loop).result()
+
+
+class AsyncPostingEngine(PostingEngine):
+    """Тот же конвейер загрузка -> сохранение -> пост, но на asyncio и aiohttp.
+
+    Загрузки - это корутины, а не потоки, поэтому одновременно их может быть
+    upload_concurrency (сотни) почти без затрат памяти. Сколько из них реально
+    отправляется сразу, решает тот же UploadController, что и в PostingEngine,
+    с потолком max_uploads (по умолчанию upload_concurrency). Журнал, кэш,
+    порядок пакетов и время публикации общие с PostingEngine, поэтому результат тот же.
+    """
+
+    upload_concurrency = 100
+    retry_policy_class = AsyncRetryPolicy
+    # Потолок UploadController: корутины дёшевы, поэтому он равен upload_concurrency.
+    upload_workers = upload_concurrency
+    max_upload_workers = upload_concurrency
+    upload_window = 300
+    upload_timeout = 60
+    api_url = API_URL
+    # Как часто ждущая загрузка перепроверяет лимит, изменённый из другого потока (set_max_uploads, cancel).
+    slot_poll = 0.5
+
+    def run(self):
+        if aiohttp is None:
+            self.log("[🧰ERROR] Для asyncio-движка нужен aiohttp: pip install aiohttp")
+            return {"status": "error", "posts": 0, "failed": 0, "error": "aiohttp не установлен"}
+        return asyncio.run(self.run_async())
+
+    async def wait_if_paused_async(self):
+        if self.paused:
+            self.journal.flush()
+        while self.paused and not self.cancelled:
+            await asyncio.sleep(0.5)
+
+    async def run_async(self):
+        self.log("[📶] Подключение к API ВКонтакте (asyncio)...")
+        connector = aiohttp.TCPConnector(limit=self.upload_concurrency + 4)
+        async with aiohttp.ClientSession(connector=connector) as http:
+            api = AsyncVkApi(http, self.token, get_rate_limiter(self.token), self.api_url, self.metrics)
+            if self.session is not None:
+                # Проверка токена и данные сообщества - из общей сессии, обычно уже из кэша.
+                try:
+                    await asyncio.to_thread(log_group, self.session, self.group_id, self.log)
+                except Exception as e:
+                    self.log(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
+                    return {"status": "error", "posts": 0, "failed": 0, "error": str(e)}
+            try:
+                if self.session is not None:
+                    current_time = await asyncio.to_thread(self.session.server_time)
+                else:
+                    current_time = await api.method("utils.getServerTime")
+                self.log(
+                    f"[⏰] Точное время сервера: {datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M')}"
+                )
+            except Exception:
+                current_time = None
+                self.log("[🤬WARN] Не удалось получить время сервера. Используется локальное время.")
+
+            source = None
+            in_flight = deque()
+            entries = {}
+
+            async def fill_window():
+                while len(in_flight) < window:
+                    # Сканирование и хэширование блокируют, поэтому идут в отдельном потоке.
+                    item = await asyncio.to_thread(next, source, None)
+                    if item is None:
+                        queue.flush()
+                        return
+                    number, files = item
+                    entries = {f: self.saved_media.get(f) for f in files}
+                    queue.add(entries)
+                    in_flight.append((number, entries))
+
+            try:
+                source = self.open_run()
+                await asyncio.to_thread(self.plan_schedule, AsyncWallBridge(api, asyncio.get_running_loop()), current_time)
+                self.start_preprocessor()
+                self.upload_server = None
+                self.upload_server_lock = asyncio.Lock()
+                self.slot_cond = asyncio.Condition()
+                semaphore = asyncio.Semaphore(self.upload_concurrency)
+                window = max(2, self.upload_window // self.batch_size)
+                queue = UploadQueue(
+                    self.upload_group_size(),
+                    lambda group: asyncio.create_task(self.upload_photos_async(http, api, semaphore, group))
+                )
+
+                await fill_window()
+                while in_flight:
+                    batch_number, entries = in_flight.popleft()
+                    await fill_window()
+                    queue.flush(entries)
+                    await self.wait_if_paused_async()
+                    if self.cancelled:
+                        break
+
+                    try:
+                        uploads = []
+                        dead = self.take_shared(entries)
+                        for entry, names in self.upload_tasks(entries, dead).items():
+                            try:
+                                uploads.append(await entry)
+                            except UploadCancelled:
+                                raise
+                            except Exception as e:
+                                dead.update(dict.fromkeys(names, str(e)))
+                        if self.cancelled:
+                            break
+                        saved, failed = await self.save_with_retry_async(http, api, semaphore, uploads)
+                        self.share_results(entries, saved, failed)
+                        dead.update((name, reason) for name, reason in failed.items() if name in entries)
+                        if dead:
+                            self.hold_batch(batch_number, entries, saved, dead)
+                            continue
+                        media_ids = self.collect_media(entries, saved)
+                        post_time = self.plan_post_time(batch_number)
+                        params = {
+                            "owner_id": int(self.group_id),
+                            "from_group": 1,
+                            "message": self.post_text(),
+                            "attachments": ",".join(media_ids),
+                            "publish_date": post_time,
+                            "guid": self.post_guid(batch_number),
+                        }
+                        response = await self.retry(
+                            lambda: api.method("wall.post", params),
+                            self.retry_logger("post", f"Пост #{batch_number} не добавлен"),
+                        )
+                        self.record_post(batch_number, response['post_id'], post_time, media_ids)
+                    except UploadCancelled:
+                        break
+                    except Exception as e:
+                        self.record_failure(batch_number, entries, e)
+
+                self.finish_run()
+            except Exception as e:
+                self.fail_run(e)
+            finally:
+                # Задача загрузки альбома общая для нескольких пакетов, поэтому без повторов.
+                pending = list(dict.fromkeys(
+                    entry for batch in [entries, *(batch for _, batch in in_flight)]
+                    for entry in batch.values() if isinstance(entry, asyncio.Task)
+                ))
+                for task in pending:
+                    task.cancel()
+                # Отменённые загрузки должны завершиться до закрытия журнала и сессии aiohttp.
+                await asyncio.gather(*pending, return_exceptions=True)
+                if source is not None:
+                    source.close()
+                self.close_run()
+                self.log(f"[🚦] Текущий лимит запросов к API: {api.limiter.current_rate():.1f}/с")
+
+        return self.summary()
+
+    async def retry(self, make_call, on_retry):
+        # То же, что RetryPolicy.run, но с await и asyncio.sleep.
+        policy = self.retry_policy
+        for attempt in range(policy.attempts):
+            try:
+                return await make_call()
+            except UploadCancelled:
+                raise
+            except Exception as e:
+                if attempt + 1 >= policy.attempts or not policy.is_transient(e) or self.cancelled:
+                    raise
+                delay = policy.delay(attempt)
+                on_retry(attempt, delay, e)
+                await asyncio.sleep(delay)
+
+    async def save_with_retry_async(self, http, api, semaphore, uploads):
+        # Как PostingEngine.save_with_retry: временно не сохранённые фото загружаются заново.
+        saved = {}
+        dead = {}
+        attempts = self.retry_policy.attempts
+        for attempt in range(attempts):
+            try:
+                results = self.save_results(await self.execute(api, self.save_calls(uploads))) if uploads else []
+            except Exception as e:
+                results = [(None, e)] * len(uploads)
+            retry = self.match_saved(uploads, results, saved, dead, attempt + 1 < attempts)
+            if not retry or self.cancelled:
+                break
+            delay = self.retry_policy.delay(attempt)
+            self.metrics.inc("retries", len(retry), stage="save")
+            self.log(f"[🔄] {len(retry)} фото не сохранились, загружаю их заново через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            uploads = []
+            groups = self.upload_groups(retry)
+            results = await asyncio.gather(
+                *(self.upload_photos_async(http, api, semaphore, group) for group in groups),
+                return_exceptions=True
+            )
+            for group, result in zip(groups, results):
+                if isinstance(result, BaseException):
+                    dead.update(dict.fromkeys(group, str(result)))
+                else:
+                    uploads.append(result)
+        return saved, dead
+
+    async def execute(self, api, calls):
+        results = []
+        for start in range(0, len(calls), VkExecuteBatch.limit):
+            chunk = calls[start:start + VkExecuteBatch.limit]
+            response = await api.method("execute", {"code": VkExecuteBatch.build_code(chunk)}, raw=True)
+            results.extend(VkExecuteBatch.parse_response(chunk, response, api.limiter))
+        return results
+
+    @asynccontextmanager
+    async def upload_slot(self, work):
+        # UploadController.slot для корутин: место в лимите ждём в цикле событий, а не в потоке.
+        controller = self.upload_controller
+        async with self.slot_cond:
+            while not controller.try_acquire():
+                try:
+                    await asyncio.wait_for(self.slot_cond.wait(), self.slot_poll)
+                except asyncio.TimeoutError:
+                    pass
+        try:
+            started = time.perf_counter()
+            yield
+            cost = (time.perf_counter() - started) / work
+        except BaseException as e:
+            controller.release(overloaded=controller.is_overload(e) or isinstance(e, asyncio.TimeoutError))
+            raise
+        else:
+            controller.release(cost)
+        finally:
+            async with self.slot_cond:
+                self.slot_cond.notify_all()
+
+    async def get_upload_server(self, api):
+        async with self.upload_server_lock:
+            if self.upload_server is None or time.time() - self.upload_server_at > 600:
+                if self.album_id:
+                    self.upload_server = await api.method(
+                        "photos.getUploadServer", {"album_id": self.album_id, "group_id": abs(int(self.group_id))}
+                    )
+                else:
+                    self.upload_server = await api.method(
+                        "photos.getWallUploadServer", {"group_id": abs(int(self.group_id))}
+                    )
+                self.upload_server_at = time.time()
+            return self.upload_server
+
+    async def upload_photos_async(self, http, api, semaphore, photo_files):
+        await self.wait_if_paused_async()
+        async with semaphore:
+            if self.cancelled:
+                raise UploadCancelled("Загрузка отменена")
+            label = ", ".join(photo_files)
+            upload_paths = []
+            try:
+                for photo_file in photo_files:
+                    full_path = os.path.join(self.folder_path, photo_file)
+                    upload_paths.append((full_path, await asyncio.to_thread(self.prepare_photo, full_path)))
+                self.log(f"[📩] Загружаю {label}")
+                server, photo_data, photo_hash = await self.upload_photo_async(
+                    http, api, [upload_path for _, upload_path in upload_paths]
+                )
+                return photo_files, server, photo_data, photo_hash
+            except Exception as e:
+                self.log(f"[🧰ERROR] Ошибка при загрузке {label}: {e}")
+                raise
+            finally:
+                for full_path, upload_path in upload_paths:
+                    if upload_path != full_path:
+                        os.remove(upload_path)
+
+    async def upload_photo_async(self, http, api, photo_paths):
+        timeout = aiohttp.ClientTimeout(total=self.upload_timeout)
+        # Как в PostingEngine.upload_photo: 0.25 - накладные расходы на запрос в МБ.
+        work = 0.25 + sum(os.path.getsize(path) for path in photo_paths) / (1024 * 1024)
+
+        async def attempt():
+            server = await self.get_upload_server(api)
+            try:
+                async with self.upload_slot(work):
+                    with ExitStack() as files, self.metrics.timer("upload"):
+                        form = aiohttp.FormData()
+                        for field, path in self.upload_fields(photo_paths):
+                            form.add_field(
+                                field, files.enter_context(open(path, 'rb')), filename=os.path.basename(path)
+                            )
+                        async with http.post(server['upload_url'], data=form, timeout=timeout) as response:
+                            if response.status == 429:
+                                self.metrics.inc("rate_limited", stage="upload")
+                            response.raise_for_status()
+                            text = await response.text()
+                return self.parse_upload_response(text)
+            except Exception:
+                if self.upload_server is server:
+                    self.upload_server = None
+                raise
+
+        try:
+            return await self.retry(
+                attempt,
+                self.retry_logger("upload", f"Ошибка загрузки {', '.join(map(os.path.basename, photo_paths))}")
+            )
+        except Exception:
+            self.metrics.inc("errors", stage="upload")
+            raise
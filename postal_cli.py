@@ -0,0 +1,279 @@
+import sys
+import os
+import time
+import json
+import signal
+import argparse
+import threading
+from datetime import datetime
+
+import multiprocessing
+
+from postal_core import (
+    load_config, normalize_group_id, log_level, PostingEngine, CheckAndClearEngine, EditPostponedEngine,
+    FanoutScheduler,
+    JsonLogFile, RunJournal, EMOJI_LIST, PHOTO_ORDERS, LOG_LEVELS, LOG_PATH
+)
+
+
+EXIT_OK = 0
+EXIT_PARTIAL = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+EXIT_CANCELLED = 130
+
+EXIT_CODES = {"ok": EXIT_OK, "partial": EXIT_PARTIAL, "error": EXIT_ERROR, "cancelled": EXIT_CANCELLED}
+
+
+class JsonLinesOutput:
+    # Каждое событие - одна строка JSON в stdout, удобно для cron/systemd и jq.
+
+    def __init__(self, stream=None, level="info", log_file=None):
+        self.stream = stream or sys.stdout
+        self.lock = threading.Lock()
+        self.min_level = LOG_LEVELS[level]
+        self.log_file = log_file
+
+    def emit(self, event, **fields):
+        record = {"ts": round(time.time(), 3), "event": event, **fields}
+        line = json.dumps(record, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def log(self, message, job=None):
+        if self.log_file is not None:
+            self.log_file.write(message, job=job)
+        level = log_level(message)
+        if LOG_LEVELS[level] < self.min_level:
+            return
+        fields = {"job": job} if job is not None else {}
+        self.emit("log", level=level, message=message, **fields)
+
+
+def parse_start(value):
+    if value.isdigit():
+        return int(value)
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%d.%m.%Y %H:%M"):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp())
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Некорректная дата: {value}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="postal_cli",
+        description="VK Going Auto-Postal без GUI: постинг, проверка, изменение и очистка отложки."
+    )
+    parser.add_argument("--token", help="Токен VK API (по умолчанию $VK_TOKEN или last_settings.cfg)")
+    parser.add_argument("--group", help="Числовой ID сообщества (по умолчанию из last_settings.cfg)")
+    parser.add_argument("--log-level", choices=tuple(LOG_LEVELS), default="info",
+                        help="Какие сообщения выводить в stdout (в файл пишутся все)")
+    # Путь обязателен: с nargs="?" голый --log-file забирал бы имя команды, идущей следом.
+    parser.add_argument("--log-file", metavar="PATH",
+                        help=f"Дописывать полный лог в JSON-lines файл с ротацией (как в окне: {os.path.basename(LOG_PATH)})")
+    parser.add_argument("--metrics-file",
+                        help="Сохранить метрики запуска: *.prom - в формате Prometheus, иначе JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    post = commands.add_parser("post", help="Залить фото из папки в отложку")
+    post.add_argument("--folder", default=os.path.join(os.path.dirname(sys.argv[0]), "photos"))
+    post.add_argument("--interval", type=int, default=2, help="Интервал постов в часах")
+    post.add_argument("--start", type=parse_start,
+                      help='Время первого поста: "YYYY-MM-DD HH:MM" или unix time '
+                           '(по умолчанию последний пост + интервал, либо сейчас)')
+    post.add_argument("--photos-per-post", type=int, help="Кол-во фото на один пост (1-9)")
+    post.add_argument("--caption", default="")
+    post.add_argument("--random-emoji", action="store_true")
+    post.add_argument("--order", choices=PHOTO_ORDERS, default="name")
+    post.add_argument("--preprocess", action="store_true", help="Сжимать фото перед загрузкой (нужен Pillow)")
+    post.add_argument("--max-side", type=int, default=2560)
+    post.add_argument("--quality", type=int, default=90)
+    post.add_argument("--engine", choices=("threads", "asyncio"), default="threads",
+                      help="asyncio - загрузки на aiohttp вместо пула потоков")
+    post.add_argument("--max-uploads", type=int,
+                      help=f"Потолок одновременных загрузок, сам лимит подбирается по задержкам и ошибкам "
+                           f"(по умолчанию {PostingEngine.upload_workers}, с --engine asyncio - 100)")
+    post.add_argument("--album", type=int,
+                      help="ID альбома сообщества: грузить через него по 5 фото за запрос (и из соседних постов) "
+                           "и прикреплять к постам")
+    post.add_argument("--dry-run", action="store_true",
+                      help="Ничего не загружать и не обращаться к ВК: план постов и оценка времени")
+    post.add_argument("--dead-letters", action="store_true",
+                      help="Повторить только фото из очереди неудавшихся для этой папки")
+
+    commands.add_parser("check", help="Посчитать отложенные записи")
+    commands.add_parser("clear", help="Удалить все отложенные записи")
+    edit = commands.add_parser("edit", help="Сдвинуть, переразложить или переподписать отложенные записи")
+    edit.add_argument("--shift", type=float, default=0, help="Сдвиг в часах (можно дробный и отрицательный)")
+    edit.add_argument("--interval", type=float, help="Разложить заново с этим интервалом в часах")
+    edit.add_argument("--start", type=parse_start, help="С какого времени раскладывать (с --interval)")
+    edit.add_argument("--caption", help="Новая подпись ко всем выбранным записям")
+    edit.add_argument("--since", type=parse_start, help="Только записи, запланированные не раньше")
+    edit.add_argument("--until", type=parse_start, help="Только записи, запланированные раньше")
+    dead = commands.add_parser("dead", help="Показать очередь неудавшихся фото")
+    dead.add_argument("--folder", help="Только для этой папки")
+
+    fanout = commands.add_parser("fanout", help="Залить отложку в несколько сообществ параллельно")
+    fanout.add_argument("jobs_file", help='JSON: {"jobs": [{"token": ..., "group_id": ..., "folder": ..., '
+                                          '"interval_hours": 2, "start": "YYYY-MM-DD HH:MM"}, ...]}')
+    fanout.add_argument("--max-jobs", type=int, default=3, help="Сколько сообществ обрабатывать одновременно")
+    fanout.add_argument("--max-uploads", type=int, default=18, help="Сколько фото загружать одновременно всего")
+    return parser
+
+
+def load_jobs(path, default_token):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    jobs = data["jobs"] if isinstance(data, dict) else data
+    for job in jobs:
+        job.setdefault("token", default_token)
+        if not job.get("token") or not job.get("group_id") or not job.get("folder"):
+            raise ValueError("У каждого задания должны быть token, group_id и folder")
+        if "start" in job:
+            job["start_timestamp"] = parse_start(str(job["start"]))
+        if int(job.get("start_timestamp") or 0) < int(time.time()):
+            job["start_timestamp"] = int(time.time())
+    return jobs
+
+
+def run_fanout(args, out, default_token):
+    try:
+        jobs = load_jobs(args.jobs_file, default_token)
+    except (OSError, ValueError, KeyError, argparse.ArgumentTypeError) as e:
+        out.emit("done", status="usage", error=f"Некорректный файл заданий: {e}")
+        return EXIT_USAGE
+
+    scheduler = FanoutScheduler(
+        jobs, args.max_jobs, args.max_uploads,
+        log=lambda job, message: out.log(message, job),
+        on_progress=lambda report: out.emit("progress", **report),
+    )
+    results = scheduler.run()
+    statuses = {result["status"] for result in results}
+    if statuses <= {"ok"}:
+        status = "ok"
+    elif statuses == {"error"}:
+        status = "error"
+    else:
+        status = "partial"
+    out.emit("done", status=status, jobs=results)
+    return EXIT_CODES[status]
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    out = JsonLinesOutput(level=args.log_level, log_file=JsonLogFile(args.log_file) if args.log_file else None)
+    try:
+        return run_command(args, out)
+    finally:
+        if out.log_file is not None:
+            out.log_file.close()
+
+
+def run_command(args, out):
+    config = load_config()
+
+    token = args.token or os.environ.get("VK_TOKEN") or config.get("token", "")
+    if args.command == "fanout":
+        return run_fanout(args, out, token)
+
+    group = args.group or config.get("group_id", "")
+    offline = args.command == "dead" or (args.command == "post" and args.dry_run)
+    if not group or (not token and not offline):
+        out.emit("done", status="usage", error="Нужны токен и ID сообщества")
+        return EXIT_USAGE
+    try:
+        group_id = normalize_group_id(group)
+    except ValueError:
+        out.emit("done", status="usage", error="ID должно быть числом")
+        return EXIT_USAGE
+
+    if args.command == "dead":
+        journal = RunJournal()
+        try:
+            letters = journal.dead_letters(group_id, args.folder)
+        finally:
+            journal.close()
+        for folder, name, error in letters:
+            out.emit("dead", folder=folder, name=name, error=error)
+        out.emit("done", status="ok", count=len(letters))
+        return EXIT_OK
+
+    if args.command == "post":
+        photos_per_post = args.photos_per_post or int(config.get("photos_per_post") or 9)
+        if not 1 <= photos_per_post <= 9 or args.interval < 1:
+            out.emit("done", status="usage", error="Кол-во фото должно быть от 1 до 9, интервал - от 1 часа")
+            return EXIT_USAGE
+        if not os.path.isdir(args.folder):
+            out.emit("done", status="usage", error=f'Папка "{args.folder}" не найдена')
+            return EXIT_USAGE
+
+        start_timestamp = args.start
+        if start_timestamp is None and config.get("last_post_time"):
+            start_timestamp = config["last_post_time"] + args.interval * 3600
+        if start_timestamp is None or start_timestamp < int(time.time()):
+            start_timestamp = int(time.time())
+
+        engine_class = PostingEngine
+        if args.engine == "asyncio":
+            from postal_async import AsyncPostingEngine
+            engine_class = AsyncPostingEngine
+
+        engine = engine_class(
+            token, group_id, args.interval, args.folder, start_timestamp, str(photos_per_post),
+            args.caption, args.random_emoji, list(EMOJI_LIST), args.order,
+            args.preprocess, args.max_side, args.quality,
+            log=out.log,
+            on_post_time=lambda publish_date: out.emit("post", publish_date=publish_date),
+            metrics_path=args.metrics_file,
+            max_uploads=args.max_uploads,
+            dead_letters=args.dead_letters,
+            album_id=args.album,
+        )
+        if args.dry_run:
+            result = engine.dry_run()
+            out.emit("done", **result)
+            return EXIT_OK
+        # Ctrl+C / SIGTERM: доделать начатое и выйти, недоделанное останется в журнале.
+        for signum in (signal.SIGINT, getattr(signal, "SIGTERM", None)):
+            if signum is not None:
+                signal.signal(signum, lambda *_: engine.cancel())
+    elif args.command == "edit":
+        if not args.shift and args.interval is None and args.caption is None:
+            out.emit("done", status="usage", error="Укажите --shift, --interval или --caption")
+            return EXIT_USAGE
+        if args.interval is not None and args.interval <= 0:
+            out.emit("done", status="usage", error="Интервал должен быть больше нуля")
+            return EXIT_USAGE
+        engine = EditPostponedEngine(
+            token, group_id,
+            shift=int(args.shift * 3600),
+            interval=int(args.interval * 3600) if args.interval else None,
+            start=args.start,
+            caption=args.caption,
+            since=args.since,
+            until=args.until,
+            log=out.log,
+            metrics_path=args.metrics_file,
+        )
+    else:
+        engine = CheckAndClearEngine(
+            token, group_id, args.command,
+            log=out.log,
+            on_count=lambda count: out.emit("count", count=count),
+            metrics_path=args.metrics_file,
+        )
+
+    result = engine.run()
+    out.emit("metrics", **engine.metrics.snapshot())
+    out.emit("done", **result)
+    return EXIT_CODES.get(result["status"], EXIT_ERROR)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,2829 @@
+import sys
+import os
+import time
+from datetime import datetime
+import vk_api
+from vk_api.exceptions import ApiError
+import requests
+from requests.adapters import HTTPAdapter
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque
+from contextlib import nullcontext, contextmanager
+from functools import partial
+
+import threading 
+import json
+
+import random
+
+import bisect
+import sqlite3
+import hashlib
+import heapq
+import re
+import tempfile
+import shutil
+import uuid
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+
+CONFIG_PATH = os.path.join(os.path.dirname(sys.argv[0]), "last_settings.cfg")
+INDEX_DIR = os.path.join(os.path.dirname(sys.argv[0]), "postponed_index")
+JOURNAL_PATH = os.path.join(os.path.dirname(sys.argv[0]), "postal_journal.sqlite3")
+MEDIA_CACHE_PATH = os.path.join(os.path.dirname(sys.argv[0]), "media_cache.sqlite3")
+LOG_PATH = os.path.join(os.path.dirname(sys.argv[0]), "postal_log.jsonl")
+
+
+
+def load_config():
+    if not os.path.exists(CONFIG_PATH):
+        return {}
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    config = {}
+    try:
+        config["token"] = lines[0].strip() if len(lines) > 0 else ""
+        config["group_id"] = lines[1].strip() if len(lines) > 1 else ""
+        config["photos_per_post"] = lines[2].strip() if len(lines) > 2 else "9"
+        if len(lines) > 3:
+            config["last_post_time"] = int(lines[3].strip())
+        else:
+            config["last_post_time"] = None
+    except Exception:
+        return {}
+    return config
+
+
+def save_config(token="", group_id="", photos_per_post="9", last_post_time=None):
+    try:
+        with open(CONFIG_PATH, "w", encoding="utf-8") as f:
+            f.write(f"{token}\n")
+            f.write(f"{group_id}\n")
+            f.write(f"{photos_per_post}\n")
+            if last_post_time is not None:
+                f.write(f"{last_post_time}\n")
+    except Exception as e:
+        print(f"[🧰ERROR] Не удалось сохранить конфиг: {e}")
+
+
+
+def normalize_group_id(value):
+    # ВК ждёт id сообщества со знаком минус; принимаем и без него.
+    group_id = int(str(value).strip())
+    if group_id > 0:
+        group_id = -group_id
+    return str(group_id)
+
+
+def log_level(message):
+    # Уровень сообщения по его метке: "[🧰ERROR] ...", "[🤬WARN] ...".
+    tag = message[:message.find("]") + 1] if message.startswith("[") else ""
+    if "ERROR" in tag:
+        return "error"
+    if "WARN" in tag:
+        return "warning"
+    return "info"
+
+
+LOG_LEVELS = {"info": 0, "warning": 1, "error": 2}
+
+
+class JsonLogFile:
+    """Лог в файл по строке JSON на сообщение, с ротацией по размеру.
+
+    Пишется из любого потока. Файлы: postal_log.jsonl, postal_log.jsonl.1 ... .N
+    """
+
+    max_bytes = 5 * 1024 * 1024
+    backups = 3
+
+    def __init__(self, path=LOG_PATH, max_bytes=None, backups=None):
+        self.path = path
+        self.max_bytes = max_bytes or self.max_bytes
+        self.backups = self.backups if backups is None else backups
+        self.lock = threading.Lock()
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, message, **fields):
+        record = {"ts": round(time.time(), 3), "level": log_level(message), "message": message}
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file is None:
+                return
+            if self.file.tell() + len(line) > self.max_bytes:
+                self.rotate()
+            self.file.write(line)
+
+    def rotate(self):
+        self.file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "w", encoding="utf-8")
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+
+API_URL = "https://api.vk.ru/method/"
+API_VERSION = "5.92"
+
+TOO_MANY_RPS_CODE = 6
+FLOOD_CONTROL_CODE = 9
+RATE_ERROR_CODES = (TOO_MANY_RPS_CODE, FLOOD_CONTROL_CODE)
+
+
+class RateLimiter:
+    """Token bucket для запросов к API, подстраивающийся под ответы ВК.
+
+    Скорость растёт на step после каждых ~10 секунд без ошибок и падает
+    вдвое при ошибке 6 (слишком много запросов в секунду). Ошибка 9
+    (flood control) вдобавок останавливает все запросы на flood_pause секунд.
+    """
+
+    min_rate = 0.5
+    max_rate = 20.0
+    step = 0.5
+    flood_pause = 5.0
+
+    def __init__(self, rate=3.0, burst=3):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Забирает жетон (баланс может уйти в минус) и возвращает, сколько ждать.
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def on_success(self):
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.rate * 10 and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.step)
+                self.successes = 0
+
+    def on_rate_error(self, code):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+            self.successes = 0
+            if code == FLOOD_CONTROL_CODE:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + self.flood_pause)
+
+    def current_rate(self):
+        with self.lock:
+            return self.rate
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(token):
+    # Лимиты ВК считаются на токен, поэтому и ограничитель один на токен.
+    with _rate_limiters_lock:
+        if token not in _rate_limiters:
+            _rate_limiters[token] = RateLimiter()
+        return _rate_limiters[token]
+
+
+METRICS_PATH = os.path.join(os.path.dirname(sys.argv[0]), "last_metrics.json")
+
+
+class Metrics:
+    """Счётчики и гистограммы времени по этапам одного запуска.
+
+    Этапы - вызовы API ("api:wall.post", "api:execute"...), ожидание лимита
+    запросов ("rate_wait"), хэширование, сжатие и загрузка фото. Пишется из
+    любого потока; snapshot() отдаёт сводку для GUI и JSON, prometheus() -
+    текст в формате Prometheus (например, для textfile-коллектора node_exporter).
+    """
+
+    buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            stats = self.stages.get(stage)
+            if stats is None:
+                stats = self.stages[stage] = {
+                    "count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(self.buckets) + 1)
+                }
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["buckets"][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def total(self, name):
+        with self.lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+
+    def quantile(self, stats, q):
+        # Оценка по гистограмме: верхняя граница корзины, в которую попал q-й процентиль.
+        rank = q * stats["count"]
+        seen = 0
+        for bound, count in zip(self.buckets, stats["buckets"]):
+            seen += count
+            if seen >= rank:
+                return min(bound, stats["max"])
+        return stats["max"]
+
+    def snapshot(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self.lock:
+            stages = {
+                stage: {
+                    "count": stats["count"],
+                    "sum": round(stats["sum"], 3),
+                    "avg": round(stats["sum"] / stats["count"], 3),
+                    "p50": round(self.quantile(stats, 0.5), 3),
+                    "p95": round(self.quantile(stats, 0.95), 3),
+                    "max": round(stats["max"], 3),
+                }
+                for stage, stats in self.stages.items()
+            }
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                key = ":".join([name] + [str(label) for _, label in labels])
+                counters[key] = value
+        photos = counters.get("photos", 0)
+        posts = counters.get("posts", 0)
+        return {
+            "started": int(self.started),
+            "elapsed": round(elapsed, 1),
+            "photos_per_minute": round(photos * 60 / elapsed, 2),
+            "posts_per_minute": round(posts * 60 / elapsed, 2),
+            "stages": stages,
+            "counters": counters,
+        }
+
+    def prometheus(self):
+        def labels_text(labels):
+            return ",".join(f'{key}="{value}"' for key, value in labels)
+
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE postal_stage_seconds histogram",
+        ]
+        with self.lock:
+            for stage, stats in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), stats["buckets"]):
+                    cumulative += count
+                    lines.append(f'postal_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'postal_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+                lines.append(f'postal_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE postal_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        suffix = f"{{{labels_text(labels)}}}" if labels else ""
+                        lines.append(f"postal_{name}_total{suffix} {value}")
+        for gauge in ("elapsed", "photos_per_minute", "posts_per_minute"):
+            lines.append(f"# TYPE postal_{gauge} gauge")
+            lines.append(f"postal_{gauge} {snapshot[gauge]}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        # Формат по расширению: .prom - Prometheus, иначе JSON.
+        if path.endswith(".prom"):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+
+class LimitedVkApi(vk_api.VkApi):
+    # Все вызовы API идут через общий RateLimiter вместо фиксированной паузы vk_api.
+    RPS_DELAY = 0
+
+    def __init__(self, *args, limiter=None, metrics=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or RateLimiter()
+        self.metrics = metrics or Metrics()
+
+    def method(self, method, values=None, **kwargs):
+        self.metrics.observe("rate_wait", self.limiter.acquire())
+        try:
+            with self.metrics.timer(f"api:{method}"):
+                response = super().method(method, values, **kwargs)
+        except ApiError as e:
+            self.metrics.inc("api_errors", method=method, code=e.code)
+            if e.code in RATE_ERROR_CODES:
+                self.limiter.on_rate_error(e.code)
+            raise
+        self.limiter.on_success()
+        return response
+
+    def too_many_rps_handler(self, error):
+        self.metrics.inc("api_errors", method=error.method, code=TOO_MANY_RPS_CODE)
+        self.metrics.inc("retries", stage="api")
+        self.limiter.on_rate_error(TOO_MANY_RPS_CODE)
+        return error.try_method()
+
+
+
+class ApiUrlAdapter(HTTPAdapter):
+    # Отправляет запросы к API ВК на другой адрес, например на локальный mock-сервер из bench/.
+
+    def __init__(self, api_url, **kwargs):
+        self.api_url = api_url
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if self.api_url != API_URL and request.url.startswith(API_URL):
+            request.url = self.api_url + request.url[len(API_URL):]
+        return super().send(request, **kwargs)
+
+
+class HttpPool:
+    """Пул keep-alive соединений, общий для загрузок фото и сессии vk_api.
+
+    pool_size - сколько соединений держать открытыми к одному хосту;
+    должен быть не меньше числа потоков загрузки, иначе потоки ждут.
+    """
+
+    api_url = API_URL
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.adapter = ApiUrlAdapter(self.api_url, pool_connections=8, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def vk_session(self, token, metrics=None):
+        return LimitedVkApi(
+            token=token, session=self.session, api_version=API_VERSION, limiter=get_rate_limiter(token),
+            metrics=metrics
+        )
+
+    def stats(self):
+        total_requests = 0
+        total_connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                total_requests += pool.num_requests
+                total_connections += pool.num_connections
+        return total_requests, total_connections
+
+    def log_stats(self, log, metrics=None, since=(0, 0)):
+        # since - stats() на начало запуска: пул общей сессии переживает запуски
+        # (вытесненные из пула хосты уносят свои счётчики, поэтому не меньше нуля).
+        total_requests, total_connections = self.stats()
+        total_requests = max(total_requests - since[0], 0)
+        total_connections = max(total_connections - since[1], 0)
+        if metrics is not None:
+            metrics.inc("http_requests", total_requests)
+            metrics.inc("http_connections", total_connections)
+        log(f"[🔌] HTTP: {total_requests} запросов через {total_connections} соединений (пул {self.pool_size})")
+
+    def close(self):
+        self.session.close()
+
+
+
+class ApiSession:
+    """Долгоживущее подключение к API для одного токена, общее для всех действий окна.
+
+    Держит один HttpPool (соединения остаются тёплыми между запусками),
+    проверяет токен при первом обращении к сообществу и кэширует смещение
+    часов сервера (clock_max_age секунд) и данные сообществ (group_max_age).
+    Потокобезопасен: движки в разных потоках берут из него vk_session и кэш.
+    """
+
+    pool_size = 40
+    clock_max_age = 3600
+    group_max_age = 600
+
+    def __init__(self, token, pool_size=None):
+        self.token = token
+        self.http = HttpPool(pool_size=pool_size or self.pool_size)
+        self.api = self.http.vk_session(token)
+        self.lock = threading.Lock()
+        self.clock_offset = None
+        self.clock_at = 0.0
+        self.groups = {}
+
+    def vk_session(self, metrics=None):
+        # Своя LimitedVkApi на каждый движок (у неё свои метрики), но пул и RateLimiter общие.
+        return self.http.vk_session(self.token, metrics)
+
+    def server_time(self):
+        with self.lock:
+            if self.clock_offset is None or time.monotonic() - self.clock_at > self.clock_max_age:
+                self.clock_offset = self.api.method("utils.getServerTime") - time.time()
+                self.clock_at = time.monotonic()
+            return int(time.time() + self.clock_offset)
+
+    def group(self, group_id):
+        # groups.getById; заодно проверяет токен - с неверным ВК вернёт ошибку 5.
+        key = abs(int(group_id))
+        with self.lock:
+            cached = self.groups.get(key)
+            if cached is None or time.monotonic() - cached[0] > self.group_max_age:
+                cached = self.groups[key] = (time.monotonic(), self.api.method("groups.getById", {"group_id": key})[0])
+            return cached[1]
+
+    def close(self):
+        self.http.close()
+
+
+
+def log_group(session, group_id, log):
+    # С общей сессией первое обращение проверяет токен, дальше данные берутся из кэша.
+    if session is not None:
+        group = session.group(group_id)
+        log(f"[👥] Сообщество: {group.get('name', abs(int(group_id)))}")
+
+
+def close_http(session, http):
+    # Пул общей сессии закрывает её владелец (окно), а не движок.
+    if session is None:
+        http.close()
+
+
+
+class VkExecuteBatch:
+    """Собирает вызовы API и отправляет их пачками через execute.
+
+    Один execute вмещает до 25 вызовов. run() возвращает список пар
+    (результат, ошибка) в порядке добавления; у успешного вызова ошибка
+    None, у неуспешного результат None, а ошибка - словарь из execute_errors.
+    """
+
+    limit = 25
+
+    def __init__(self, vk_session):
+        self.vk_session = vk_session
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def add(self, method, **params):
+        self.calls.append((method, params))
+        return len(self.calls) - 1
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        results = []
+        for start in range(0, len(calls), self.limit):
+            results.extend(self.execute(calls[start:start + self.limit]))
+        return results
+
+    def execute(self, calls):
+        response = self.vk_session.method("execute", {"code": self.build_code(calls)}, raw=True)
+        return self.parse_response(calls, response, getattr(self.vk_session, "limiter", None))
+
+    @staticmethod
+    def build_code(calls):
+        return "return [" + ",".join(
+            f"API.{method}({json.dumps(params, ensure_ascii=False)})" for method, params in calls
+        ) + "];"
+
+    @staticmethod
+    def parse_response(calls, response, limiter=None):
+        values = response.get("response") or [False] * len(calls)
+        execute_errors = response.get("execute_errors", [])
+        if limiter is not None:
+            for error in execute_errors:
+                if error.get("error_code") in RATE_ERROR_CODES:
+                    limiter.on_rate_error(error["error_code"])
+        errors = iter(execute_errors)
+
+        results = []
+        for (method, _), value in zip(calls, values):
+            if value is False:
+                error = next(errors, None) or {"method": method, "error_code": 0, "error_msg": "Пустой ответ execute"}
+                results.append((None, error))
+            else:
+                results.append((value, None))
+        return results
+
+
+
+class UploadCancelled(Exception):
+    pass
+
+
+class UploadController:
+    """AIMD-регулятор числа одновременных загрузок фото, не зависящий от размера поста.
+
+    Лимит растёт на 1 после каждых limit загрузок без проблем и падает вдвое,
+    если сервер перегружен (таймаут, 429 или 5xx) или загрузка заметно
+    замедлилась: сглаженное время на единицу работы выше лучшего в
+    latency_factor раз. Другие ошибки (битый файл, отказ принять фото) лимит
+    не трогают. Потолок max_limit можно менять на ходу, а cancel() будит всех
+    ждущих и запрещает новые загрузки.
+    """
+
+    min_limit = 1
+    latency_factor = 2.5
+    smoothing = 0.2
+
+    def __init__(self, max_limit=16, initial=4):
+        self.max_limit = max_limit
+        self.limit = max(self.min_limit, min(initial, max_limit))
+        self.in_flight = 0
+        self.successes = 0
+        self.cooldown = 0
+        self.smoothed = None
+        self.best = None
+        self.cancelled = False
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while not self.try_acquire():
+                self.cond.wait()
+
+    def try_acquire(self):
+        # Без ожидания: True, если место есть (и уже занято), для корутин asyncio-движка.
+        with self.cond:
+            if self.cancelled:
+                raise UploadCancelled("Загрузка отменена")
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, cost=None, overloaded=False):
+        # cost - время на единицу работы удачной загрузки; overloaded - неудача из-за перегрузки.
+        with self.cond:
+            self.in_flight -= 1
+            self.cooldown = max(0, self.cooldown - 1)
+            if overloaded:
+                self.decrease()
+            elif cost is not None:
+                self.smoothed = cost if self.smoothed is None else self.smoothed + self.smoothing * (cost - self.smoothed)
+                self.best = self.smoothed if self.best is None else min(self.best, self.smoothed)
+                if self.smoothed > self.best * self.latency_factor:
+                    self.decrease()
+                else:
+                    self.successes += 1
+                    if self.successes >= self.limit and self.limit < self.max_limit:
+                        self.limit += 1
+                        self.successes = 0
+            self.cond.notify_all()
+
+    def decrease(self):
+        # Ответы на уже начатые загрузки придут с прежней нагрузкой - их пропускаем.
+        if self.cooldown:
+            return
+        self.limit = max(self.min_limit, self.limit // 2)
+        self.successes = 0
+        self.cooldown = self.in_flight + 1
+        if self.best is not None:
+            # Если медленно стало не из-за нас, ориентир постепенно подтягивается к новому времени.
+            self.best *= 1.25
+
+    @staticmethod
+    def is_overload(error):
+        # Таймаут, 429 или 5xx; битый файл или отказ ВК принять фото - не повод снижать лимит.
+        if isinstance(error, (requests.Timeout, TimeoutError)):
+            return True
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(error, "status", None)
+        return isinstance(status, int) and (status == 429 or status >= 500)
+
+    @contextmanager
+    def slot(self, work=1.0, gate=None):
+        # gate - общий для нескольких движков семафор (FanoutScheduler); он берётся уже
+        # после места в лимите, и ожидание его не считается временем загрузки.
+        self.acquire()
+        try:
+            with gate or nullcontext():
+                started = time.perf_counter()
+                yield
+                cost = (time.perf_counter() - started) / work
+        except BaseException as e:
+            self.release(overloaded=self.is_overload(e))
+            raise
+        self.release(cost)
+
+    def set_max(self, max_limit):
+        with self.cond:
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(self.limit, self.max_limit)
+            self.cond.notify_all()
+
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+    def state(self):
+        with self.cond:
+            return {"limit": self.limit, "in_flight": self.in_flight, "max_limit": self.max_limit}
+
+
+
+class PermanentError(Exception):
+    # Ошибка, которую повтор не исправит: битый файл, нет доступа, неверные параметры.
+    pass
+
+
+class TransientError(Exception):
+    # Сбой на стороне сервера, который стоит повторить: пустой или нечитаемый ответ.
+    pass
+
+
+class RetryPolicy:
+    """Повторы с экспоненциальной задержкой и случайным разбросом (full jitter).
+
+    Временные ошибки (таймауты и обрывы соединения из TRANSIENT_ERRORS, HTTP
+    429/5xx, ошибки API из TRANSIENT_API_CODES) повторяются до attempts раз с
+    паузой random(0, min(cap, base * 2**n)); остальные отдаются наверх сразу.
+    """
+
+    attempts = 4
+    base = 1.0
+    cap = 30.0
+    # 1 - неизвестная ошибка, 6/9 - лимиты, 10 - внутренняя ошибка сервера, 603 - ошибка в execute.
+    TRANSIENT_API_CODES = (1, 6, 9, 10, 603)
+    # Сетевые ошибки; у asyncio-движка к ним добавляются ошибки aiohttp.
+    TRANSIENT_ERRORS = (TransientError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+    def __init__(self, attempts=None, base=None, cap=None):
+        self.attempts = attempts or self.attempts
+        self.base = self.base if base is None else base
+        self.cap = self.cap if cap is None else cap
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+    @classmethod
+    def is_transient(cls, error):
+        if isinstance(error, PermanentError):
+            return False
+        if isinstance(error, dict):
+            return error.get("error_code") in cls.TRANSIENT_API_CODES
+        # HTTP-статус проверяется раньше кода API: у aiohttp.ClientResponseError
+        # есть и status, и code с тем же HTTP-статусом.
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or getattr(error, "status", None)
+        if isinstance(status, int):
+            return status == 429 or status >= 500
+        code = getattr(error, "code", None)
+        if isinstance(error, ApiError) or isinstance(code, int):
+            return code in cls.TRANSIENT_API_CODES
+        return isinstance(error, cls.TRANSIENT_ERRORS)
+
+    def run(self, func, on_retry=None, sleep=time.sleep):
+        # on_retry(номер попытки, пауза, ошибка) вызывается перед каждым повтором.
+        for attempt in range(self.attempts):
+            try:
+                return func()
+            except UploadCancelled:
+                raise
+            except Exception as e:
+                if attempt + 1 >= self.attempts or not self.is_transient(e):
+                    raise
+                delay = self.delay(attempt)
+                if on_retry is not None:
+                    on_retry(attempt, delay, e)
+                sleep(delay)
+
+
+
+class MultipartFile:
+    """Тело multipart/form-data с файлами, которое читается по кусочкам.
+
+    requests.post(files=...) собирает всё тело в памяти; этот объект отдаёт
+    заголовки частей, файлы блоками по chunk_size и завершающую границу,
+    поэтому память на загрузку не зависит от размера фото. files - список
+    пар (имя поля, путь). Длина известна заранее (__len__), так что запрос
+    уходит с Content-Length, а не chunked. progress(отправлено, всего)
+    вызывается после каждого блока.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, files, progress=None, chunk_size=None):
+        self.boundary = uuid.uuid4().hex
+        self.progress = progress
+        self.chunk_size = chunk_size or self.chunk_size
+        # Части тела по порядку: bytes отдаются как есть, str - путь к файлу.
+        self.parts = []
+        separator = b""
+        for field, path in files:
+            filename = os.path.basename(path).replace('"', "%22")
+            self.parts.append(separator + (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n\r\n'
+            ).encode("utf-8"))
+            self.parts.append(path)
+            separator = b"\r\n"
+        self.parts.append(separator + f'--{self.boundary}--\r\n'.encode("ascii"))
+        self.length = sum(len(part) if isinstance(part, bytes) else os.path.getsize(part) for part in self.parts)
+        self.position = 0
+        self.file = None
+        self.buffer = b""
+        self.sent = 0
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        # requests считает тело потоковым, только если его можно итерировать.
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self)
+        while len(self.buffer) < size and (self.file is not None or self.position < len(self.parts)):
+            if self.file is None:
+                part = self.parts[self.position]
+                self.position += 1
+                if isinstance(part, bytes):
+                    self.buffer += part
+                else:
+                    self.file = open(part, 'rb')
+                continue
+            chunk = self.file.read(max(size - len(self.buffer), self.chunk_size))
+            if not chunk:
+                self.close()
+            self.buffer += chunk
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        if data:
+            self.sent += len(data)
+            if self.progress is not None:
+                self.progress(self.sent, len(self))
+        return data
+
+
+class UploadServerCache:
+    """Общий для потоков загрузки адрес сервера загрузки фото на стену
+    (или в альбом album_id).
+
+    Адрес запрашивается один раз и переиспользуется, пока сервер загрузки
+    его не отвергнет или не истечёт max_age секунд.
+    """
+
+    max_age = 600
+
+    def __init__(self, vk, group_id, album_id=None):
+        self.vk = vk
+        self.group_id = abs(int(group_id))
+        self.album_id = album_id
+        self.lock = threading.Lock()
+        self.server = None
+        self.fetched_at = 0.0
+
+    def get(self):
+        with self.lock:
+            if self.server is None or time.time() - self.fetched_at > self.max_age:
+                if self.album_id:
+                    self.server = self.vk.photos.getUploadServer(album_id=self.album_id, group_id=self.group_id)
+                else:
+                    self.server = self.vk.photos.getWallUploadServer(group_id=self.group_id)
+                self.fetched_at = time.time()
+            return self.server
+
+    def invalidate(self, server):
+        with self.lock:
+            if self.server is server:
+                self.server = None
+
+
+
+class UploadQueue:
+    """Раскладывает ещё не загруженные фото пакетов из окна по запросам загрузки.
+
+    В режиме альбома (size > 1) в один запрос идут до size фото подряд, в том
+    числе из соседних постов: при одном фото на пост запросов так в size раз
+    меньше. submit(файлы) запускает загрузку и возвращает её задачу, которая
+    записывается в entries каждого поста вместо None.
+    """
+
+    def __init__(self, size, submit):
+        self.size = size
+        self.submit = submit
+        self.pending = []
+
+    def add(self, entries):
+        # entries: {файл: media id или None}; None - фото ещё нужно загрузить.
+        self.pending.extend((entries, name) for name, entry in entries.items() if entry is None)
+        while len(self.pending) >= self.size:
+            self.send(self.pending[:self.size])
+            del self.pending[:self.size]
+
+    def flush(self, entries=None):
+        # Отправляет неполный остаток; с entries - только если в нём есть фото этого поста.
+        if self.pending and (entries is None or any(owner is entries for owner, _ in self.pending)):
+            self.send(self.pending)
+            self.pending = []
+
+    def send(self, group):
+        task = self.submit(tuple(name for _, name in group))
+        for entries, name in group:
+            entries[name] = task
+
+
+
+class PostponedIndex:
+    """Локальный индекс отложенных записей одного сообщества.
+
+    Хранит только id, publish_date и id вложений каждой записи и лежит в
+    INDEX_DIR между запусками. sync() сверяет индекс с ВК одним запросом
+    wall.get(count=1) и обходит всю отложку только при расхождении. Такая
+    проверка видит лишь число записей и первую из них, поэтому удаление и
+    планирование слотов, где важна каждая запись, вызывают sync(force=True).
+    """
+
+    page_size = 100
+
+    def __init__(self, group_id):
+        self.owner_id = -abs(int(group_id))
+        self.path = os.path.join(INDEX_DIR, f"postponed_{abs(self.owner_id)}.json")
+        self.lock = threading.RLock()
+        self.posts = {}
+        self.dates = []
+        self.synced_at = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            posts = {int(post_id): (date, attachments) for post_id, (date, attachments) in data["posts"].items()}
+        except Exception:
+            return
+        with self.lock:
+            self.replace(posts)
+            self.synced_at = data.get("synced_at", 0)
+
+    def save(self):
+        with self.lock:
+            data = {
+                "synced_at": self.synced_at,
+                "posts": {str(post_id): [date, attachments] for post_id, (date, attachments) in self.posts.items()},
+            }
+        try:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[🧰ERROR] Не удалось сохранить индекс отложки: {e}")
+
+    def replace(self, posts):
+        with self.lock:
+            self.posts = posts
+            self.dates = sorted((date, post_id) for post_id, (date, _) in posts.items())
+
+    def add(self, post_id, publish_date, attachments=()):
+        with self.lock:
+            self.remove(post_id)
+            self.posts[post_id] = (publish_date, list(attachments))
+            bisect.insort(self.dates, (publish_date, post_id))
+
+    def remove(self, post_id):
+        with self.lock:
+            entry = self.posts.pop(post_id, None)
+            if entry is not None:
+                i = bisect.bisect_left(self.dates, (entry[0], post_id))
+                del self.dates[i]
+
+    def prune(self, now=None):
+        # Опубликованные записи уходят из отложки сами.
+        now = now or int(time.time())
+        with self.lock:
+            cut = bisect.bisect_right(self.dates, (now, float("inf")))
+            for _, post_id in self.dates[:cut]:
+                del self.posts[post_id]
+            del self.dates[:cut]
+
+    def count(self):
+        with self.lock:
+            return len(self.posts)
+
+    def ids(self):
+        with self.lock:
+            return [post_id for _, post_id in self.dates]
+
+    def range(self, start=None, end=None):
+        # Записи с start <= publish_date < end в порядке публикации: [(publish_date, id)].
+        with self.lock:
+            lo = 0 if start is None else bisect.bisect_left(self.dates, (start,))
+            hi = len(self.dates) if end is None else bisect.bisect_left(self.dates, (end,))
+            return self.dates[lo:hi]
+
+    def bounds(self):
+        with self.lock:
+            if not self.dates:
+                return None, None
+            return self.dates[0][0], self.dates[-1][0]
+
+    def sync(self, vk, force=False):
+        # Возвращает True, если пришлось обойти всю отложку.
+        self.prune()
+        if not force:
+            response = vk.wall.get(owner_id=self.owner_id, filter='postponed', count=1)
+            items = response.get('items', [])
+            with self.lock:
+                fresh = response.get('count', 0) == len(self.posts) and all(item['id'] in self.posts for item in items)
+            if fresh:
+                self.synced_at = int(time.time())
+                self.save()
+                return False
+
+        posts = {}
+        for item in self.crawl(vk):
+            posts[item['id']] = (item['date'], self.attachment_ids(item))
+        self.replace(posts)
+        self.synced_at = int(time.time())
+        self.save()
+        return True
+
+    def crawl(self, vk):
+        # Постраничный обход без накопления полных записей в памяти.
+        offset = 0
+        while True:
+            response = vk.wall.get(owner_id=self.owner_id, filter='postponed', count=self.page_size, offset=offset)
+            items = response.get('items', [])
+            if not items:
+                break
+            yield from items
+            offset += self.page_size
+
+    @staticmethod
+    def attachment_ids(item):
+        ids = []
+        for attachment in item.get('attachments', []):
+            media = attachment.get(attachment.get('type'), {})
+            if 'owner_id' in media and 'id' in media:
+                ids.append(f"{attachment['type']}{media['owner_id']}_{media['id']}")
+        return ids
+
+
+
+class SlotAllocator:
+    """Раскладка новых постов по сетке start + k * interval вокруг уже занятой отложки.
+
+    times - отсортированные времена публикации из PostponedIndex, загруженные
+    одним проходом. Точка сетки пропускается, если ближе min_gap секунд к ней
+    уже есть запись, если этот день уже заполнен до daily_cap или если она в
+    прошлом. Занятость проверяется бинарным поиском, поэтому свободные места
+    между старыми постами заполняются без обхода всей отложки. Всего в отложке
+    не бывает больше queue_cap записей - лишние посты не планируются вовсе.
+    """
+
+    queue_cap = 1500
+    daily_cap = 50
+    min_gap = 60
+    # Пост должен уходить в отложку хотя бы с таким запасом от текущего момента.
+    min_lead = 300
+
+    def __init__(self, times, now=None):
+        self.times = sorted(times)
+        self.now = now or int(time.time())
+        self.per_day = {}
+        for publish_date in self.times:
+            day = self.day(publish_date)
+            self.per_day[day] = self.per_day.get(day, 0) + 1
+        self.skipped = 0
+
+    @staticmethod
+    def day(publish_date):
+        return datetime.fromtimestamp(publish_date).date()
+
+    def is_free(self, publish_date):
+        i = bisect.bisect_left(self.times, publish_date - self.min_gap + 1)
+        if i < len(self.times) and self.times[i] < publish_date + self.min_gap:
+            return False
+        return self.per_day.get(self.day(publish_date), 0) < self.daily_cap
+
+    def take(self, publish_date):
+        bisect.insort(self.times, publish_date)
+        day = self.day(publish_date)
+        self.per_day[day] = self.per_day.get(day, 0) + 1
+
+    def plan(self, start, interval, count):
+        # Список времён публикации для count постов по порядку; короче count,
+        # если отложка упёрлась в queue_cap.
+        # Наступившие времена уже не в отложке и места в ней не занимают (дневной счёт остаётся).
+        del self.times[:bisect.bisect_right(self.times, self.now)]
+        step = max(int(interval), self.min_gap)
+        k = max(0, -(-(self.now + self.min_lead - start) // step))
+        planned = []
+        while len(planned) < count and len(self.times) < self.queue_cap:
+            publish_date = start + k * step
+            k += 1
+            if not self.is_free(publish_date):
+                self.skipped += 1
+                continue
+            self.take(publish_date)
+            planned.append(publish_date)
+        return planned
+
+
+
+class RunJournal:
+    """Журнал запусков постинга в SQLite.
+
+    Для каждого файла хранит номер пакета, сохранённый media id, id поста и
+    время публикации. Незавершённый запуск для той же группы и папки
+    продолжается с того же места. Записи копятся в памяти и сбрасываются
+    пачкой каждые flush_every изменений или flush_interval секунд. Сохранённые
+    фото и опубликованные посты записываются сразу: потеря такой записи при
+    сбое означала бы повторную загрузку и дубль поста при продолжении.
+
+    Фото, которые не удалось загрузить и после повторов, получают состояние
+    'dead' (очередь неудавшихся) вместе с причиной; их повторяет отдельный
+    запуск с mode='dead' (см. requeue_dead).
+    """
+
+    flush_every = 20
+    flush_interval = 5.0
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.flushed_at = time.monotonic()
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "id INTEGER PRIMARY KEY, group_id TEXT, folder TEXT, photos_per_post INTEGER, "
+                "interval_hours INTEGER, start_timestamp INTEGER, created INTEGER, finished INTEGER DEFAULT 0)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "run_id INTEGER, name TEXT, batch INTEGER, media_id TEXT, post_id INTEGER, "
+                "publish_date INTEGER, state TEXT, PRIMARY KEY (run_id, name))"
+            )
+            # Колонки, добавленные позже: старые журналы дополняются на месте.
+            for table, column in (("runs", "mode TEXT DEFAULT 'folder'"), ("files", "error TEXT"), ("files", "hash TEXT")):
+                columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+                if column.split()[0] not in columns:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+
+    def open_run(self, group_id, folder, photos_per_post, interval_hours, start_timestamp, mode="folder"):
+        # Возвращает (run_id, photos_per_post, interval_hours, start_timestamp, resumed).
+        folder = os.path.abspath(folder)
+        row = self.conn.execute(
+            "SELECT id, photos_per_post, interval_hours, start_timestamp FROM runs "
+            "WHERE group_id = ? AND folder = ? AND mode = ? AND finished = 0 ORDER BY id DESC LIMIT 1",
+            (str(group_id), folder, mode)
+        ).fetchone()
+        if row:
+            return (*row, True)
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO runs (group_id, folder, photos_per_post, interval_hours, start_timestamp, created, mode) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(group_id), folder, int(photos_per_post), interval_hours, start_timestamp, int(time.time()), mode)
+            )
+        return cursor.lastrowid, int(photos_per_post), interval_hours, start_timestamp, False
+
+    def files(self, run_id):
+        # [(name, batch, media_id, state, hash содержимого)] в порядке пакетов.
+        self.flush()
+        return self.conn.execute(
+            "SELECT name, batch, media_id, state, hash FROM files WHERE run_id = ? ORDER BY batch, rowid",
+            (run_id,)
+        ).fetchall()
+
+    def add_batch(self, run_id, batch, names, hashes=None):
+        # hashes {файл: хэш} - чтобы при продолжении отсеивать дубликаты уже записанных фото.
+        for name in names:
+            self.write(
+                "INSERT OR IGNORE INTO files (run_id, name, batch, state, hash) VALUES (?, ?, ?, 'queued', ?)",
+                (run_id, name, batch, (hashes or {}).get(name))
+            )
+
+    def mark_saved(self, run_id, name, media_id):
+        self.write(
+            "UPDATE files SET media_id = ?, state = 'saved' WHERE run_id = ? AND name = ?",
+            (media_id, run_id, name), durable=True
+        )
+
+    def mark_posted(self, run_id, batch, post_id, publish_date):
+        self.write(
+            "UPDATE files SET post_id = ?, publish_date = ?, state = 'posted' WHERE run_id = ? AND batch = ?",
+            (post_id, publish_date, run_id, batch), durable=True
+        )
+
+    def mark_dead(self, run_id, name, error):
+        self.write(
+            "UPDATE files SET state = 'dead', error = ? WHERE run_id = ? AND name = ?",
+            (error, run_id, name)
+        )
+
+    def dead_letters(self, group_id, folder=None):
+        # [(folder, name, error)] из всех запусков группы (и папки, если указана).
+        self.flush()
+        sql = (
+            "SELECT r.folder, f.name, f.error FROM files f JOIN runs r ON r.id = f.run_id "
+            "WHERE r.group_id = ? AND f.state = 'dead'"
+        )
+        params = [str(group_id)]
+        if folder is not None:
+            sql += " AND r.folder = ?"
+            params.append(os.path.abspath(folder))
+        return self.conn.execute(sql + " ORDER BY r.id, f.batch, f.rowid", params).fetchall()
+
+    def requeue_dead(self, run_id, group_id, folder, batch_size):
+        # Переносит очередь неудавшихся для группы и папки в запуск run_id
+        # пакетами по batch_size (в прежнем порядке). Возвращает число фото.
+        self.flush()
+        folder = os.path.abspath(folder)
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT f.run_id, f.name, f.hash FROM files f JOIN runs r ON r.id = f.run_id "
+                "WHERE r.group_id = ? AND r.folder = ? AND f.state = 'dead' AND f.run_id != ? "
+                "ORDER BY r.id, f.batch, f.rowid",
+                (str(group_id), folder, run_id)
+            ).fetchall()
+            hashes = {name: digest for _, name, digest in rows}
+            names = list(hashes)
+            for number, start in enumerate(range(0, len(names), batch_size)):
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO files (run_id, name, batch, state, hash) VALUES (?, ?, ?, 'queued', ?)",
+                    [(run_id, name, number, hashes[name]) for name in names[start:start + batch_size]]
+                )
+            self.conn.executemany(
+                "UPDATE files SET state = 'requeued' WHERE run_id = ? AND name = ?",
+                [(source_run, name) for source_run, name, _ in rows]
+            )
+        return len(names)
+
+    def finish(self, run_id):
+        self.write("UPDATE runs SET finished = 1 WHERE id = ?", (run_id,))
+        self.flush()
+
+    def write(self, sql, params, durable=False):
+        # durable - записать сразу (вместе с накопленным до неё, чтобы не нарушить порядок).
+        with self.lock:
+            self.pending.append((sql, params))
+            due = durable or len(self.pending) >= self.flush_every or \
+                time.monotonic() - self.flushed_at > self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, []
+            self.flushed_at = time.monotonic()
+            if pending:
+                with self.conn:
+                    for sql, params in pending:
+                        self.conn.execute(sql, params)
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+PHOTO_ORDERS = ("name", "natural", "mtime", "none")
+
+
+def natural_key(name):
+    # "img2.jpg" < "img10.jpg": числа в имени сравниваются как числа.
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def _read_spill(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def scan_photos(folder_path, order="name", chunk_size=50000):
+    """Генератор имён изображений в папке в порядке order.
+
+    "none" отдаёт файлы сразу в порядке os.scandir. Для остальных порядков
+    ключи сортируются кусками по chunk_size: кусок сортируется в памяти и
+    при необходимости сбрасывается во временный файл, а затем куски
+    сливаются через heapq.merge, так что весь список в памяти не держится.
+    """
+    def entries():
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                    yield entry
+
+    if order == "none":
+        for entry in entries():
+            yield entry.name
+        return
+
+    def sort_key(entry):
+        if order == "mtime":
+            return [entry.stat().st_mtime_ns, entry.name]
+        if order == "natural":
+            return [natural_key(entry.name), entry.name]
+        return [entry.name, entry.name]
+
+    spills = []
+    chunk = []
+    try:
+        for entry in entries():
+            chunk.append(sort_key(entry))
+            if len(chunk) >= chunk_size:
+                chunk.sort()
+                fd, path = tempfile.mkstemp(prefix="postal_scan_", suffix=".jsonl")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for item in chunk:
+                        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+                spills.append(path)
+                chunk = []
+        chunk.sort()
+        for _, name in heapq.merge(chunk, *(_read_spill(path) for path in spills)):
+            yield name
+    finally:
+        for path in spills:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def preprocess_photo(src_path, dst_dir, max_side=2560, quality=90):
+    """Проверяет фото и при необходимости уменьшает и пережимает его в JPEG.
+
+    Выполняется в отдельном процессе. Возвращает (путь для загрузки,
+    исходный размер, итоговый размер, секунды). Если пережатие не даёт
+    выигрыша (или это GIF), загружается исходный файл.
+    """
+    started = time.perf_counter()
+    original_size = os.path.getsize(src_path)
+    with Image.open(src_path) as image:
+        image.verify()
+    if src_path.lower().endswith(".gif"):
+        return src_path, original_size, original_size, time.perf_counter() - started
+
+    with Image.open(src_path) as image:
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > max_side
+        if resized:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        name = os.path.splitext(os.path.basename(src_path))[0] + ".jpg"
+        dst_path = os.path.join(dst_dir, f"{os.getpid()}_{time.monotonic_ns()}_{name}")
+        image.save(dst_path, "JPEG", quality=quality, optimize=True)
+
+    new_size = os.path.getsize(dst_path)
+    if not resized and new_size >= original_size:
+        os.remove(dst_path)
+        return src_path, original_size, original_size, time.perf_counter() - started
+    return dst_path, original_size, new_size, time.perf_counter() - started
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    """Кэш "хэш содержимого файла -> photo{owner}_{id}" для каждого сообщества.
+
+    Позволяет прикреплять уже загруженные фото вместо повторной загрузки.
+    Записи старше max_age_days и всё сверх max_entries (самые давно
+    использованные) удаляются при открытии.
+    """
+
+    max_age_days = 180
+    max_entries = 200000
+
+    def __init__(self, path=MEDIA_CACHE_PATH):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                "hash TEXT, owner_id INTEGER, media_id TEXT, size INTEGER, created INTEGER, used INTEGER, "
+                "PRIMARY KEY (hash, owner_id))"
+            )
+        self.evict()
+
+    def evict(self):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM media WHERE created < ?",
+                (int(time.time()) - self.max_age_days * 86400,)
+            )
+            self.conn.execute(
+                "DELETE FROM media WHERE rowid IN ("
+                "SELECT rowid FROM media ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def get(self, file_digest, owner_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT media_id FROM media WHERE hash = ? AND owner_id = ?",
+                (file_digest, owner_id)
+            ).fetchone()
+            if row:
+                with self.conn:
+                    self.conn.execute(
+                        "UPDATE media SET used = ? WHERE hash = ? AND owner_id = ?",
+                        (int(time.time()), file_digest, owner_id)
+                    )
+        return row[0] if row else None
+
+    def put(self, file_digest, owner_id, media_id, size):
+        now = int(time.time())
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO media (hash, owner_id, media_id, size, created, used) VALUES (?, ?, ?, ?, ?, ?)",
+                (file_digest, owner_id, media_id, size, now, now)
+            )
+
+    def discard(self, media_ids):
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM media WHERE media_id = ?", [(m,) for m in media_ids])
+
+    def close(self):
+        self.conn.close()
+
+
+
+EMOJI_LIST = [
+    "💋", "💄", "🧴", "🧼", "🧖‍♀️", "✨", "🌟", "💫", "💅", "💎", "🌸",
+    "👠", "👡", "👢", "👜", "👛", "👒", "🎀", "🧥", "🩱", "👗", "👚", "🕶️",
+    "💘", "💗", "💓", "💞", "❤️", "💌", "🌹", "💋", "😏", "😍", "😘", "🥰",
+    "🎉", "✨", "🍾", "🥂", "🍷", "🍸", "🍹",
+    "🧁", "🍰", "🍭", "🍬", "🍫", "🍩", "🍪", "🍧", "🍨", "🍦", "🧁",
+    "🧚", "🦄", "🧸", "🎀", "🔮", "🌌", "🪐", "💫", "🌠",
+    "😈", "👅", "🍑", "🍒", "🍓", "🥵", "👙", "🩳", "💦", "🩸",
+    "😳", "😍", "🤤", "😜", "😏", "😒", "😌", "🥰", "😱", "🤯", "😵‍💫",
+    "🐾", "🌷", "🌼", "🌻", "🌿", "🍀", "🍁", "🥀", "🌺",
+    "🌌", "🪐", "🌕", "🌑", "🛸", "👽", "👾", "🛰️",
+    "☕", "🍵", "🥛", "🍯", "🧁", "🍰", "🍩", "🍪", "🍧", "🍨", "🍦",
+    "🎵", "🎶", "🎧", "📻", "🎹", "🎼", "🎤", "🎙️", "🎚️", "📼",
+]
+
+
+
+# Узкие места, которые называет PostingEngine.dry_run.
+BOTTLENECKS = {
+    "upload": "загрузка фото",
+    "api": "публикация постов",
+    "preprocess": "сжатие фото",
+    "rate_limit": "лимит запросов к API",
+}
+
+
+class PostingEngine:
+    """Постинг фото из папки в отложку сообщества, без привязки к GUI.
+
+    О ходе работы сообщает через log(str) и on_post_time(publish_date);
+    run() блокирует поток до конца и возвращает итог в виде словаря.
+    """
+
+    # upload_workers - потолок одновременных загрузок по умолчанию, сам лимит подбирает
+    # UploadController; max_upload_workers - сколько потоков и соединений держать под него.
+    upload_workers = 16
+    max_upload_workers = 32
+    upload_window = 64
+    # (соединение, чтение) в секундах.
+    upload_timeout = (10, 60)
+    # Сколько файлов принимает за один запрос сервер загрузки в альбом.
+    album_files = 5
+    retry_policy_class = RetryPolicy
+
+    def __init__(self, token, group_id, interval_hours, folder_path, start_timestamp,
+                 photos_per_post, caption="", use_random_emoji=False, emoji_list=None, photo_order="name",
+                 preprocess=False, max_photo_side=2560, jpeg_quality=90, log=None, on_post_time=None,
+                 upload_slots=None, save_settings=True, metrics_path=None, max_uploads=None,
+                 dead_letters=False, on_upload_progress=None, album_id=None, session=None):
+        self.log = log or (lambda message: None)
+        # Общий ApiSession окна: пул соединений, время сервера и проверка токена уже готовы.
+        self.session = session
+        self.on_post_time = on_post_time or (lambda publish_date: None)
+        # on_upload_progress(имя файла, отправлено байт, всего байт) - по мере отправки каждого фото.
+        self.on_upload_progress = on_upload_progress
+        # Если задан - фото грузятся в этот альбом сообщества по album_files за запрос
+        # (photos.getUploadServer/photos.save) и оттуда прикрепляются к постам.
+        self.album_id = album_id
+        # Общий с другими движками семафор, ограничивающий загрузки по всем сообществам сразу.
+        self.upload_slots = upload_slots
+        self.save_settings = save_settings
+        self.photo_order = photo_order
+        self.preprocess = preprocess
+        self.max_photo_side = max_photo_side
+        self.jpeg_quality = jpeg_quality
+        self.stage_lock = threading.Lock()
+        self.metrics = Metrics()
+        # Кроме last_metrics.json метрики можно сохранить сюда (.prom - в формате Prometheus).
+        self.metrics_path = metrics_path
+        self.bytes_original = 0
+        self.bytes_uploaded = 0
+        # Что успели открыть open_run() и start_preprocessor(); close_run() закрывает только это.
+        self.journal = None
+        self.media_cache = None
+        self.index = None
+        self.preprocessor = None
+        self.last_post_time = None
+        self.failed_batches = 0
+        self.held_batches = 0
+        self.unplanned_batches = 0
+        self.allocator = None
+        self.error = None
+        self.token = token
+        self.group_id = group_id
+        self.interval_hours = interval_hours
+        self.folder_path = folder_path
+        self.start_timestamp = start_timestamp
+        self.photos_per_post = photos_per_post
+        self.posts_saved = 0
+        self.paused = False
+        self.cancelled = False
+        self.pause_cond = threading.Condition(threading.Lock())
+        self.upload_controller = UploadController(
+            min(max_uploads or self.upload_workers, self.max_upload_workers)
+        )
+        self.retry_policy = self.retry_policy_class()
+        # True - вместо папки повторить фото из очереди неудавшихся (RunJournal.requeue_dead).
+        self.dead_letters = dead_letters
+        self.caption = caption
+        self.use_random_emoji = use_random_emoji
+        self.emoji_list = emoji_list or []
+    
+    def toggle_pause(self):
+        with self.pause_cond:
+            self.paused = not self.paused
+            if not self.paused:
+                self.pause_cond.notify_all()
+
+    def wait_if_paused(self):
+        if self.paused and self.journal is not None:
+            self.journal.flush()
+        while self.paused and not self.cancelled:
+            with self.pause_cond:
+                self.pause_cond.wait(timeout=1.0)
+
+    def cancel(self):
+        # Новые загрузки и посты не начинаются; недоделанное останется в журнале.
+        self.cancelled = True
+        self.upload_controller.cancel()
+        with self.pause_cond:
+            self.pause_cond.notify_all()
+
+    def sleep(self, seconds):
+        # Пауза между повторами, которую прерывает cancel().
+        with self.pause_cond:
+            self.pause_cond.wait_for(lambda: self.cancelled, timeout=seconds)
+        if self.cancelled:
+            raise UploadCancelled("Загрузка отменена")
+
+    def retry_logger(self, stage, what):
+        def on_retry(attempt, delay, error):
+            self.metrics.inc("retries", stage=stage)
+            self.log(
+                f"[🔄] {what}: {error} (попытка {attempt + 1}/{self.retry_policy.attempts}), "
+                f"повтор через {delay:.1f} с"
+            )
+        return on_retry
+
+    def set_max_uploads(self, max_uploads):
+        self.upload_controller.set_max(min(max_uploads, self.max_upload_workers))
+
+    def run(self):
+        self.http = HttpPool(pool_size=self.max_upload_workers + 1) if self.session is None else self.session.http
+        http_since = self.http.stats()
+        try:
+            self.log("[📶] Подключение к API ВКонтакте...")
+            vk_session = self.http.vk_session(self.token, self.metrics)
+            vk = vk_session.get_api()
+            log_group(self.session, self.group_id, self.log)
+        except Exception as e:
+            self.log(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
+            close_http(self.session, self.http)
+            return {"status": "error", "posts": 0, "failed": 0, "error": str(e)}
+
+        try:
+            current_time = self.session.server_time() if self.session else vk.utils.getServerTime()
+            self.log(
+                f"[⏰] Точное время сервера: {datetime.fromtimestamp(current_time).strftime('%Y-%m-%d %H:%M')}"
+            )
+        except:
+            current_time = int(time.time())
+            self.log(
+                f"[🤬WARN] Не удалось получить время сервера. Используется локальное время."
+            )
+
+        source = None
+        executor = None
+        in_flight = deque()
+
+        def fill_window():
+            while len(in_flight) < window:
+                item = next(source, None)
+                if item is None:
+                    queue.flush()
+                    return
+                number, files = item
+                entries = {f: self.saved_media.get(f) for f in files}
+                queue.add(entries)
+                in_flight.append((number, entries))
+
+        try:
+            source = self.open_run()
+            self.plan_schedule(vk, current_time)
+            self.upload_servers = UploadServerCache(vk, self.group_id, self.album_id)
+            self.start_preprocessor()
+
+            # Фото следующих пакетов грузятся, пока публикуются предыдущие.
+            # Окно ограничивает число пакетов в работе, чтобы не держать всё в памяти.
+            window = max(2, self.upload_window // self.batch_size)
+            upload = partial(self.upload_photos, self.folder_path)
+            executor = ThreadPoolExecutor(max_workers=self.max_upload_workers)
+            queue = UploadQueue(self.upload_group_size(), lambda group: executor.submit(upload, group))
+
+            fill_window()
+            while in_flight:
+                batch_number, entries = in_flight.popleft()
+                fill_window()
+                queue.flush(entries)
+                self.wait_if_paused()
+                if self.cancelled:
+                    break
+
+                try:
+                    uploads = []
+                    dead = self.take_shared(entries)
+                    for entry, names in self.upload_tasks(entries, dead).items():
+                        try:
+                            uploads.append(entry.result())
+                        except UploadCancelled:
+                            raise
+                        except Exception as e:
+                            dead.update(dict.fromkeys(names, str(e)))
+                    if self.cancelled:
+                        break
+                    saved, failed = self.save_with_retry(vk_session, uploads)
+                    self.share_results(entries, saved, failed)
+                    dead.update((name, reason) for name, reason in failed.items() if name in entries)
+                    if dead:
+                        # Пост без части фото не публикуем: пакет целиком уходит в очередь неудавшихся.
+                        self.hold_batch(batch_number, entries, saved, dead)
+                        continue
+                    media_ids = self.collect_media(entries, saved)
+                    post_time = self.plan_post_time(batch_number)
+                    message = self.post_text()
+                    response = self.retry_policy.run(
+                        lambda: vk.wall.post(
+                            owner_id=int(self.group_id),
+                            from_group=1,
+                            message=message,
+                            attachments=",".join(media_ids),
+                            publish_date=post_time,
+                            guid=self.post_guid(batch_number)
+                        ),
+                        self.retry_logger("post", f"Пост #{batch_number} не добавлен"),
+                        self.sleep,
+                    )
+                    self.record_post(batch_number, response['post_id'], post_time, media_ids)
+                except UploadCancelled:
+                    break
+                except Exception as e:
+                    self.record_failure(batch_number, entries, e)
+
+            self.finish_run()
+        except Exception as e:
+            self.fail_run(e)
+        finally:
+            if source is not None:
+                source.close()
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self.http.log_stats(self.log, self.metrics, http_since)
+            self.close_run()
+            self.log(f"[🚦] Текущий лимит запросов к API: {vk_session.limiter.current_rate():.1f}/с")
+            close_http(self.session, self.http)
+
+        return self.summary()
+
+    def open_run(self):
+        # Открывает (или продолжает) запуск в журнале и возвращает генератор пакетов.
+        self.journal = RunJournal()
+        self.run_id, photos_per_post, interval_hours, start_timestamp, resumed = self.journal.open_run(
+            self.group_id, self.folder_path, self.photos_per_post, self.interval_hours, self.start_timestamp,
+            mode="dead" if self.dead_letters else "folder"
+        )
+        self.post_delay_seconds = interval_hours * 3600
+        self.current_post_time = start_timestamp
+        self.batch_size = photos_per_post
+        if self.dead_letters and not resumed:
+            requeued = self.journal.requeue_dead(self.run_id, self.group_id, self.folder_path, self.batch_size)
+            self.log(f"[♻️] Повторяю {requeued} фото из очереди неудавшихся.")
+
+        # Пакеты из журнала идут первыми и сохраняют свои номера (а значит и время
+        # публикации); уже сохранённые в ВК фото повторно не загружаются.
+        batches = {}
+        journaled = set()
+        # {хэш: файл} уже записанных фото: их копии, найденные при продолжении, - тоже дубликаты.
+        seen = {}
+        self.saved_media = {}
+        next_number = 0
+        for name, batch, media_id, state, digest in self.journal.files(self.run_id):
+            journaled.add(name)
+            next_number = max(next_number, batch + 1)
+            if digest is None and not self.dead_letters:
+                # Журнал старой версии, без хэшей.
+                try:
+                    digest = file_hash(os.path.join(self.folder_path, name))
+                except OSError:
+                    pass
+            if digest is not None:
+                seen.setdefault(digest, name)
+            # 'requeued' - фото уже передано запуску очереди неудавшихся и публикуется там.
+            if state in ('posted', 'dead', 'requeued'):
+                continue
+            if media_id:
+                self.saved_media[name] = media_id
+            batches.setdefault(batch, []).append(name)
+
+        if resumed:
+            self.log(
+                f"[♻️] Продолжаю прерванный запуск с {datetime.fromtimestamp(start_timestamp).strftime('%Y-%m-%d %H:%M')}: "
+                f"осталось {len(batches)} постов, {len(self.saved_media)} фото уже загружены."
+            )
+
+        self.owner_id = -abs(int(self.group_id))
+        self.media_cache = MediaCache()
+        self.hashes = {}
+        self.shared_results = {}
+        if self.dead_letters:
+            # Соседи неудавшегося фото по посту обычно уже загружены - берём их из кэша.
+            for names in batches.values():
+                for name in names:
+                    if name in self.saved_media:
+                        continue
+                    try:
+                        self.hashes[name] = file_hash(os.path.join(self.folder_path, name))
+                    except OSError:
+                        continue
+                    media_id = self.media_cache.get(self.hashes[name], self.owner_id)
+                    if media_id:
+                        self.saved_media[name] = media_id
+        self.index = PostponedIndex(self.group_id)
+        self.journal_batches = batches
+        self.journaled = journaled
+        self.next_batch_number = next_number
+        self.schedule = None
+        return self.iter_batches(
+            self.run_id, batches, next_number, journaled, self.saved_media, self.owner_id, self.batch_size, seen
+        )
+
+    def plan_schedule(self, vk, now=None):
+        # До первой загрузки: обновляет индекс отложки полным обходом (чужие правки
+        # при том же числе записей проверка по первой записи не заметит) и
+        # раскладывает все пакеты запуска по свободным слотам (SlotAllocator).
+        try:
+            self.index.sync(vk, force=True)
+        except Exception as e:
+            self.log(f"[🤬WARN] Не удалось обновить индекс отложки ({e}), планирую по сохранённому.")
+
+        numbers = sorted(self.journal_batches)
+        if not self.dead_letters:
+            new_files = sum(1 for f in scan_photos(self.folder_path, "none") if f not in self.journaled)
+            new_batches = -(-new_files // self.batch_size)
+            numbers += range(self.next_batch_number, self.next_batch_number + new_batches)
+
+        allocator = SlotAllocator([publish_date for publish_date, _ in self.index.range()], now)
+        planned = allocator.plan(self.current_post_time, self.post_delay_seconds, len(numbers))
+        # numbers - оценка сверху (дубликаты ещё не отсеяны), поэтому пакеты без места
+        # считает iter_batches по мере сканирования.
+        self.schedule = dict(zip(numbers, planned))
+        # Allocator остаётся у запуска: если слот пакета успеет пройти, новый берётся из него же.
+        self.allocator = allocator
+        if allocator.skipped:
+            self.log(
+                f"[📅] Пропущено {allocator.skipped} слотов: заняты, в прошлом или день заполнен "
+                f"({SlotAllocator.daily_cap} постов в сутки)."
+            )
+        if planned:
+            self.log(
+                f"[📅] План: {len(planned)} постов с {datetime.fromtimestamp(planned[0]).strftime('%Y-%m-%d %H:%M')} "
+                f"по {datetime.fromtimestamp(planned[-1]).strftime('%Y-%m-%d %H:%M')}."
+            )
+
+    def start_preprocessor(self):
+        self.preprocessor = None
+        if self.preprocess and Image is None:
+            self.log("[🤬WARN] Pillow не установлен, фото загружаются без сжатия.")
+        elif self.preprocess:
+            self.preprocess_dir = tempfile.mkdtemp(prefix="postal_prep_")
+            self.preprocessor = ProcessPoolExecutor(max_workers=min(self.upload_workers, os.cpu_count() or 1))
+
+    def collect_media(self, entries, saved):
+        # entries: {файл: media id из кэша/журнала или задача загрузки}; saved: {файл: media id}.
+        for name, media_id in saved.items():
+            self.journal.mark_saved(self.run_id, name, media_id)
+            self.remember_media(name, self.owner_id, media_id)
+        for name in entries:
+            self.hashes.pop(name, None)
+        return [
+            entry if isinstance(entry, str) else saved[name]
+            for name, entry in entries.items() if isinstance(entry, str) or name in saved
+        ]
+
+    def plan_post_time(self, batch_number):
+        if self.schedule is not None:
+            post_time = self.schedule[batch_number]
+        else:
+            post_time = self.current_post_time + batch_number * self.post_delay_seconds
+        if post_time < int(time.time()):
+            post_time = self.replan_post_time(batch_number)
+            self.log(
+                f"[🤬WARN] Скорректировано время для поста #{batch_number} на {datetime.fromtimestamp(post_time).strftime('%Y-%m-%d %H:%M')}"
+            )
+        else:
+            self.log(
+                f"[📅] Пост #{batch_number} запланирован на {datetime.fromtimestamp(post_time).strftime('%Y-%m-%d %H:%M')}"
+            )
+        return post_time
+
+    def replan_post_time(self, batch_number):
+        # Слот пакета прошёл (долгая пауза или загрузка): берём ближайший свободный
+        # из того же SlotAllocator, чтобы не попасть на занятое время и не превысить лимиты.
+        if self.allocator is None:
+            return int(time.time()) + 60 * (batch_number + 1)
+        self.allocator.now = int(time.time())
+        planned = self.allocator.plan(self.current_post_time, self.post_delay_seconds, 1)
+        if not planned:
+            raise Exception(f"В отложке не осталось места (не больше {SlotAllocator.queue_cap} записей)")
+        self.schedule[batch_number] = planned[0]
+        return planned[0]
+
+    def post_guid(self, batch_number):
+        # Один и тот же для повторов и продолжения запуска: если первый wall.post
+        # дошёл до ВК, а ответ потерялся, повтор не создаст второй пост.
+        return f"postal-{self.run_id}-{self.current_post_time}-{batch_number}"
+
+    def post_text(self):
+        post_text = self.caption
+
+        if self.use_random_emoji and self.emoji_list:
+            emoji = random.choice(self.emoji_list)
+            post_text += f"\n\n{emoji}"
+        return post_text
+
+    def record_post(self, batch_number, post_id, post_time, media_ids):
+        self.journal.mark_posted(self.run_id, batch_number, post_id, post_time)
+        self.index.add(post_id, post_time, media_ids)
+
+        self.posts_saved += 1
+        self.metrics.inc("posts")
+        self.metrics.inc("photos", len(media_ids))
+        self.last_post_time = post_time
+        self.on_post_time(post_time)
+
+    def hold_batch(self, batch_number, entries, saved, dead):
+        # Уже сохранённые фото пакета запоминаются в кэше, поэтому при повторе
+        # очереди неудавшихся они не загружаются заново.
+        self.collect_media(entries, saved)
+        for name in entries:
+            self.journal.mark_dead(self.run_id, name, dead.get(name, "ждёт остальные фото поста"))
+        self.held_batches += 1
+        self.metrics.inc("held_posts")
+        self.metrics.inc("dead_photos", len(dead))
+        self.log(
+            f"[🤬WARN] Пост #{batch_number} отложен: не загрузились {len(dead)} из {len(entries)} фото "
+            f"({'; '.join(f'{name}: {reason}' for name, reason in dead.items())}). "
+            f"Пакет в очереди неудавшихся."
+        )
+
+    def record_failure(self, batch_number, entries, error):
+        # Фото из кэша могли удалить в ВК - в следующий раз загрузим заново.
+        self.media_cache.discard([entry for entry in entries.values() if isinstance(entry, str)])
+        self.failed_batches += 1
+        self.metrics.inc("errors", stage="post")
+        self.log(f"[🧰ERROR] Ошибка при обработке пакета #{batch_number}: {error}")
+
+    def finish_run(self):
+        if self.cancelled:
+            self.log("[⏹️] Остановлено. Недоделанные посты останутся в журнале и продолжатся при следующем запуске.")
+        elif self.failed_batches or self.unplanned_batches:
+            if self.failed_batches:
+                self.log(
+                    f"[♻️] {self.failed_batches} постов не добавлены, они будут повторены при следующем запуске."
+                )
+            if self.unplanned_batches:
+                self.log(
+                    f"[♻️] {self.unplanned_batches} постов не поместились в отложку, "
+                    f"их фото загрузятся при следующем запуске."
+                )
+        else:
+            self.journal.finish(self.run_id)
+        if self.held_batches:
+            self.log(
+                f"[♻️] {self.held_batches} постов в очереди неудавшихся фото. "
+                f"Повторить их можно отдельным запуском (\"Повторить неудавшиеся\" или --dead-letters)."
+            )
+
+    def fail_run(self, error):
+        # Сбой вне обработки пакетов (сканирование папки, журнал, планирование):
+        # то, что уже добавлено, остаётся в журнале и продолжится при следующем запуске.
+        self.error = str(error)
+        self.metrics.inc("errors", stage="run")
+        self.log(f"[🧰ERROR] Залив прерван: {error}")
+
+    def close_run(self):
+        # Вызывается и после сбоя в open_run()/plan_schedule(), поэтому часть ресурсов может быть не открыта.
+        if self.preprocessor is not None:
+            self.preprocessor.shutdown(wait=True)
+            shutil.rmtree(self.preprocess_dir, ignore_errors=True)
+        self.log_stage_stats()
+        self.save_metrics()
+        if self.journal is not None:
+            self.journal.close()
+        if self.media_cache is not None:
+            self.media_cache.close()
+        if self.last_post_time is not None and self.save_settings:
+            save_config(self.token, self.group_id, self.photos_per_post, self.last_post_time)
+        if self.index is not None:
+            self.index.save()
+
+    def save_metrics(self):
+        paths = [METRICS_PATH] if self.save_settings else []
+        if self.metrics_path:
+            paths.append(self.metrics_path)
+        for path in paths:
+            try:
+                self.metrics.save(path)
+            except OSError as e:
+                self.log(f"[🤬WARN] Не удалось сохранить метрики в {path}: {e}")
+
+    def summary(self):
+        if self.cancelled:
+            status = "cancelled"
+        elif self.error is not None:
+            status = "error"
+        else:
+            self.log("[📝] 🧃 Все посты добавлены в отложку. Можешь пойти пить пиво.🍺")
+            status = "partial" if self.failed_batches or self.held_batches or self.unplanned_batches else "ok"
+        result = {
+            "status": status,
+            "posts": self.posts_saved,
+            "failed": self.failed_batches,
+            "held": self.held_batches,
+            "unplanned": self.unplanned_batches,
+            "last_post_time": self.last_post_time,
+        }
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+    
+    def has_slot(self, batch_number):
+        # Пакет без места в плане не загружается: ВК всё равно не примет пост.
+        return self.schedule is None or batch_number in self.schedule
+
+    # Оценки на случай, если last_metrics.json ещё нет: секунды на загрузку
+    # одного фото ~1 МБ и на один вызов API.
+    default_upload_seconds = 2.0
+    default_api_seconds = 0.3
+
+    def upload_concurrency_limit(self):
+        return self.upload_controller.max_limit
+
+    def dry_run(self, metrics_path=METRICS_PATH):
+        """Пробный запуск без обращения к ВК: план пакетов и публикаций и оценка времени.
+
+        Папка сканируется как при обычном запуске, расписание строится по
+        сохранённому индексу отложки, а время этапов берётся из метрик
+        прошлого запуска (metrics_path); если их нет - из грубых значений по умолчанию.
+        """
+        self.log("[🧪] Пробный запуск: ВКонтакте не затрагивается, фото не загружаются.")
+        batch_size = int(self.photos_per_post)
+        megabyte = 1024 * 1024
+        photos = 0
+        total_bytes = 0
+        for name in scan_photos(self.folder_path, self.photo_order):
+            try:
+                total_bytes += os.path.getsize(os.path.join(self.folder_path, name))
+            except OSError:
+                continue
+            photos += 1
+        batches = -(-photos // batch_size)
+
+        index = PostponedIndex(self.group_id)
+        index.prune()
+        allocator = SlotAllocator([publish_date for publish_date, _ in index.range()])
+        planned = allocator.plan(self.start_timestamp, self.interval_hours * 3600, batches)
+        # Пакеты, которым не нашлось места в отложке, при настоящем запуске не загружаются.
+        posts = len(planned)
+        photos_planned = min(photos, posts * batch_size)
+        bytes_planned = total_bytes * photos_planned // photos if photos else 0
+
+        # UploadQueue собирает фото в запросы подряд, не глядя на границы постов.
+        upload_requests = -(-photos_planned // self.upload_group_size())
+
+        stages, counters, source = {}, {}, "по умолчанию"
+        try:
+            with open(metrics_path, "r", encoding="utf-8") as f:
+                recorded = json.load(f)
+            stages, counters, source = recorded.get("stages", {}), recorded.get("counters", {}), metrics_path
+        except (OSError, ValueError):
+            pass
+
+        def stage_avg(stage, default):
+            stats = stages.get(stage)
+            return stats["avg"] if stats and stats.get("count") else default
+
+        # Время загрузки растёт с размером так же, как work в upload_photo: 0.25 + МБ на запрос.
+        upload_seconds = self.default_upload_seconds
+        if stages.get("upload", {}).get("count") and counters.get("upload_bytes"):
+            recorded_mb = counters["upload_bytes"] / stages["upload"]["count"] / megabyte
+            request_mb = bytes_planned / max(upload_requests, 1) / megabyte
+            upload_seconds = stages["upload"]["avg"] * (0.25 + request_mb) / (0.25 + recorded_mb)
+        execute_seconds = stage_avg("api:execute", self.default_api_seconds)
+        post_seconds = stage_avg("api:wall.post", self.default_api_seconds)
+
+        concurrency = self.upload_concurrency_limit()
+        upload_time = upload_requests * upload_seconds / concurrency
+        # Посты идут по одному: execute с сохранением фото и wall.post на каждый пакет.
+        post_time = posts * (execute_seconds + post_seconds)
+        preprocess_time = 0.0
+        if self.preprocess:
+            preprocess_time = photos_planned * stage_avg("preprocess", 0.5) / min(self.upload_workers, os.cpu_count() or 1)
+        estimate, bottleneck = max((upload_time, "upload"), (post_time, "api"), (preprocess_time, "preprocess"))
+        # Время сервера, индекс отложки, по адресу загрузки на каждые max_age секунд и по два вызова на пост.
+        api_calls = 2 + 1 + int(estimate // UploadServerCache.max_age) + posts * 2
+        api_time = api_calls / RateLimiter().rate
+        if api_time > estimate:
+            estimate, bottleneck = api_time, "rate_limit"
+
+        plan = {
+            "status": "ok",
+            "dry_run": True,
+            "photos": photos,
+            "bytes": total_bytes,
+            "batches": batches,
+            "posts": 0,
+            "failed": 0,
+            "planned_posts": posts,
+            "unplanned_batches": batches - posts,
+            "first_post_time": planned[0] if planned else None,
+            "last_post_time": planned[-1] if planned else None,
+            "upload_requests": upload_requests,
+            "api_calls": api_calls,
+            "upload_concurrency": concurrency,
+            "estimated_seconds": round(estimate, 1),
+            "bottleneck": bottleneck,
+            "timings": source,
+        }
+        self.log(
+            f"[🧪] {photos} фото ({total_bytes / megabyte:.1f} МБ) -> {batches} постов по {batch_size}. "
+            f"В отложку поместятся {posts}."
+        )
+        if planned:
+            self.log(
+                f"[📅] Публикации с {datetime.fromtimestamp(planned[0]).strftime('%Y-%m-%d %H:%M')} "
+                f"по {datetime.fromtimestamp(planned[-1]).strftime('%Y-%m-%d %H:%M')} "
+                f"(по сохранённому индексу отложки, пропущено слотов: {allocator.skipped})."
+            )
+        self.log(
+            f"[🧪] Запросов загрузки: {upload_requests}, вызовов API: ~{api_calls}, "
+            f"одновременных загрузок до {concurrency}. Время этапов: {source}."
+        )
+        self.log(
+            f"[⏱️] Оценка времени: ~{estimate / 60:.1f} мин "
+            f"(загрузка {upload_time / 60:.1f}, посты {post_time / 60:.1f}, лимит API {api_time / 60:.1f} мин). "
+            f"Узкое место: {BOTTLENECKS[bottleneck]}."
+        )
+        return plan
+
+    def iter_batches(self, run_id, journal_batches, next_number, journaled, saved_media, owner_id, batch_size,
+                     seen=None):
+        # Сначала недоделанные пакеты из журнала, затем новые файлы по мере
+        # сканирования папки. Дубликаты внутри папки отсеиваются по содержимому
+        # до загрузки, а уже загруженные в это сообщество фото берутся из кэша.
+        # seen - {хэш: файл} фото, уже записанных в журнал этого запуска.
+        # Пакеты без места в плане не загружаются, а только считаются в unplanned_batches.
+        unplanned = 0
+        for number in sorted(journal_batches):
+            if self.has_slot(number):
+                yield number, journal_batches[number]
+            else:
+                unplanned += 1
+        if self.dead_letters:
+            self.count_unplanned(unplanned)
+            return
+
+        self.log(f"[🔎] Сканирую папку (порядок: {self.photo_order})...")
+        seen = dict(seen or {})
+        batch = []
+        found = 0
+        cached = 0
+        for f in scan_photos(self.folder_path, self.photo_order):
+            if f in journaled:
+                continue
+            try:
+                with self.metrics.timer("hash"):
+                    digest = file_hash(os.path.join(self.folder_path, f))
+            except OSError as e:
+                self.log(f"[🧰ERROR] Не удалось прочитать {f}: {e}")
+                continue
+            if digest in seen:
+                self.log(f"[👯] {f} совпадает с {seen[digest]}, пропускаю.")
+                continue
+            seen[digest] = f
+            found += 1
+            batch.append(f)
+            if not self.has_slot(next_number):
+                if len(batch) == batch_size:
+                    unplanned += 1
+                    next_number += 1
+                    batch = []
+                continue
+            self.hashes[f] = digest
+            media_id = self.media_cache.get(digest, owner_id)
+            if media_id:
+                saved_media[f] = media_id
+                cached += 1
+
+            if len(batch) == batch_size:
+                self.journal.add_batch(run_id, next_number, batch, self.hashes)
+                yield next_number, batch
+                next_number += 1
+                batch = []
+
+        if batch:
+            if self.has_slot(next_number):
+                self.journal.add_batch(run_id, next_number, batch, self.hashes)
+                yield next_number, batch
+            else:
+                unplanned += 1
+
+        self.log(f"[🔎] Найдено {found} изображений для публикации.")
+        if cached:
+            self.log(f"[♻️] {cached} из них уже загружались раньше и будут прикреплены без загрузки.")
+        self.count_unplanned(unplanned)
+
+    def count_unplanned(self, unplanned):
+        self.unplanned_batches = unplanned
+        if unplanned:
+            self.log(
+                f"[🤬WARN] {unplanned} постов не поместились в отложку (не больше {SlotAllocator.queue_cap} записей). "
+                f"Их фото не загружаются и останутся до следующего запуска."
+            )
+
+    def upload_group_size(self):
+        # Сколько файлов уходит на сервер загрузки одним запросом.
+        return self.album_files if self.album_id else 1
+
+    def upload_groups(self, names):
+        size = self.upload_group_size()
+        return [tuple(names[i:i + size]) for i in range(0, len(names), size)]
+
+    @staticmethod
+    def upload_tasks(entries, skip=()):
+        # {задача загрузки: [файлы пакета]}: в режиме альбома одна задача грузит до
+        # album_files файлов, в том числе соседних пакетов (см. UploadQueue).
+        tasks = {}
+        for name, entry in entries.items():
+            if not isinstance(entry, str) and name not in skip:
+                tasks.setdefault(entry, []).append(name)
+        return tasks
+
+    def share_results(self, entries, saved, dead):
+        # Запрос загрузки в альбом бывает общим для нескольких постов, а сохраняется
+        # один раз - первым из них. Итог по фото следующих постов ждёт их в shared_results.
+        for name, media_id in saved.items():
+            if name not in entries:
+                self.shared_results[name] = (media_id, None)
+        for name, reason in dead.items():
+            if name not in entries:
+                self.shared_results[name] = (None, reason)
+
+    def take_shared(self, entries):
+        # Подставляет в пакет то, что уже сохранил предыдущий пост; возвращает {файл: причина} неудавшихся.
+        dead = {}
+        for name, entry in entries.items():
+            if not isinstance(entry, str) and name in self.shared_results:
+                media_id, reason = self.shared_results.pop(name)
+                if media_id:
+                    entries[name] = media_id
+                else:
+                    dead[name] = reason
+        return dead
+
+    def upload_fields(self, photo_paths):
+        # Сервер загрузки на стену ждёт поле photo, в альбом - file1..file5.
+        if self.album_id:
+            return [(f"file{number}", path) for number, path in enumerate(photo_paths, 1)]
+        return [('photo', path) for path in photo_paths]
+
+    def upload_photo(self, upload_servers, photo_paths):
+        # Получение адреса сервера и сама загрузка повторяются вместе: после ошибки
+        # адрес сбрасывается и следующая попытка начинается с нового.
+        # Время загрузки почти пропорционально размеру; 0.25 - накладные расходы на запрос в МБ.
+        work = 0.25 + sum(os.path.getsize(path) for path in photo_paths) / (1024 * 1024)
+        label = ", ".join(os.path.basename(path) for path in photo_paths)
+        progress = None
+        if self.on_upload_progress is not None:
+            progress = partial(self.on_upload_progress, label)
+
+        def attempt():
+            server = upload_servers.get()
+            try:
+                with self.upload_controller.slot(work, self.upload_slots), self.metrics.timer("upload"):
+                    with MultipartFile(self.upload_fields(photo_paths), progress) as body:
+                        response = self.http.post(
+                            server['upload_url'], data=body, headers={'Content-Type': body.content_type},
+                            timeout=self.upload_timeout
+                        )
+                    if response.status_code == 429:
+                        self.metrics.inc("rate_limited", stage="upload")
+                    response.raise_for_status()
+                    return self.parse_upload_response(response.text)
+            except UploadCancelled:
+                raise
+            except Exception:
+                upload_servers.invalidate(server)
+                raise
+
+        try:
+            return self.retry_policy.run(
+                attempt, self.retry_logger("upload", f"Ошибка загрузки {label}"), self.sleep
+            )
+        except UploadCancelled:
+            raise
+        except Exception:
+            self.metrics.inc("errors", stage="upload")
+            raise
+
+    @staticmethod
+    def parse_upload_response(text):
+        if not text:
+            raise TransientError("Получен пустой ответ от сервера")
+
+        try:
+            result = json.loads(text)
+        except json.JSONDecodeError:
+            raise TransientError(f"Не удалось декодировать JSON: {text[:500]}...")
+
+        if "error" in result:
+            # Сервер загрузки отказал в самом файле (формат, размер) - повтор не поможет.
+            raise PermanentError(f"Ошибка от ВК: {result['error']}")
+        # Сервер загрузки на стену отвечает полем photo, в альбом - photos_list.
+        photo = result.get('photo', result.get('photos_list'))
+        if photo in (None, "", "[]"):
+            # Сервер принял запрос, но не нашёл в нём изображения - повтор не поможет.
+            raise PermanentError("Сервер загрузки не принял файл (не изображение или слишком большой)")
+
+        return result['server'], photo, result['hash']
+
+    def save_wall_photos(self, vk_session, uploads):
+        batch = VkExecuteBatch(vk_session)
+        for method, params in self.save_calls(uploads):
+            batch.add(method, **params)
+        return self.save_results(batch.run())
+
+    def save_with_retry(self, vk_session, uploads):
+        # Возвращает ({файл: media id}, {файл: причина}). Фото, которое ВК не сохранил
+        # из-за временной ошибки, проходит всю цепочку заново: hash загрузки одноразовый.
+        saved = {}
+        dead = {}
+        attempts = self.retry_policy.attempts
+        for attempt in range(attempts):
+            try:
+                results = self.save_wall_photos(vk_session, uploads) if uploads else []
+            except UploadCancelled:
+                raise
+            except Exception as e:
+                results = [(None, e)] * len(uploads)
+            retry = self.match_saved(uploads, results, saved, dead, attempt + 1 < attempts)
+            if not retry:
+                break
+            delay = self.retry_policy.delay(attempt)
+            self.metrics.inc("retries", len(retry), stage="save")
+            self.log(f"[🔄] {len(retry)} фото не сохранились, загружаю их заново через {delay:.1f} с")
+            self.sleep(delay)
+            uploads = []
+            for group in self.upload_groups(retry):
+                try:
+                    uploads.append(self.upload_photos(self.folder_path, group))
+                except UploadCancelled:
+                    raise
+                except Exception as e:
+                    dead.update(dict.fromkeys(group, str(e)))
+        return saved, dead
+
+    def match_saved(self, uploads, results, saved, dead, can_retry):
+        # Раскладывает ответы сохранения по файлам: saved/dead дополняются на месте,
+        # возвращаются файлы, которые стоит загрузить заново.
+        retry = []
+        for (photo_files, *_), (media_ids, error) in zip(uploads, results):
+            if error is None and len(media_ids) != len(photo_files):
+                # Без соответствия файлам сохранённые фото нельзя прикрепить по порядку.
+                error = PermanentError(f"Сохранено {len(media_ids)} из {len(photo_files)} фото")
+            if error is None:
+                saved.update(zip(photo_files, media_ids))
+            elif can_retry and self.retry_policy.is_transient(error):
+                retry.extend(photo_files)
+            else:
+                for photo_file in photo_files:
+                    dead[photo_file] = self.error_text(error)
+                    self.log(f"[🧰ERROR] Ошибка при сохранении {photo_file}: {self.error_text(error)}")
+                self.metrics.inc("errors", len(photo_files), stage="save")
+        return retry
+
+    @staticmethod
+    def error_text(error):
+        if isinstance(error, dict):
+            return f"[{error.get('error_code')}] {error.get('error_msg')}"
+        return str(error)
+
+    def save_calls(self, uploads):
+        if self.album_id:
+            return [
+                ("photos.save", {
+                    "album_id": self.album_id,
+                    "group_id": abs(int(self.group_id)),
+                    "server": server,
+                    "photos_list": photo_data,
+                    "hash": photo_hash,
+                })
+                for photo_files, server, photo_data, photo_hash in uploads
+            ]
+        return [
+            ("photos.saveWallPhoto", {
+                "group_id": abs(int(self.group_id)),
+                "server": server,
+                "photo": photo_data,
+                "hash": photo_hash,
+            })
+            for photo_files, server, photo_data, photo_hash in uploads
+        ]
+
+    @staticmethod
+    def save_results(results):
+        # Ответы photos.saveWallPhoto/photos.save -> [([media id, ...] или None, ошибка или None)].
+        return [
+            (None, error) if error else ([f"photo{photo['owner_id']}_{photo['id']}" for photo in photos], None)
+            for photos, error in results
+        ]
+
+    def remember_media(self, photo_file, owner_id, media_id):
+        full_path = os.path.join(self.folder_path, photo_file)
+        try:
+            digest = self.hashes.get(photo_file) or file_hash(full_path)
+            self.media_cache.put(digest, owner_id, media_id, os.path.getsize(full_path))
+        except OSError:
+            pass
+
+    def upload_photos(self, folder_path, photo_files):
+        # Грузит файлы одним запросом (несколько - только в альбом) и возвращает
+        # (файлы, server, photo, hash); если не загрузились - исключение.
+        self.wait_if_paused()
+        if self.cancelled:
+            raise UploadCancelled("Загрузка отменена")
+        label = ", ".join(photo_files)
+        upload_paths = []
+        try:
+            for photo_file in photo_files:
+                full_path = os.path.join(folder_path, photo_file)
+                upload_paths.append((full_path, self.prepare_photo(full_path)))
+            self.log(f"[📩] Загружаю {label}")
+            server, photo_data, photo_hash = self.upload_photo(
+                self.upload_servers, [upload_path for _, upload_path in upload_paths]
+            )
+            return photo_files, server, photo_data, photo_hash
+        except UploadCancelled:
+            raise
+        except Exception as e:
+            self.log(f"[🧰ERROR] Ошибка при загрузке {label}: {e}")
+            raise
+        finally:
+            for full_path, upload_path in upload_paths:
+                if upload_path != full_path:
+                    os.remove(upload_path)
+
+    def prepare_photo(self, full_path):
+        if self.preprocessor is None:
+            size = os.path.getsize(full_path)
+            with self.stage_lock:
+                self.bytes_original += size
+                self.bytes_uploaded += size
+            self.metrics.inc("upload_bytes", size)
+            return full_path
+        upload_path, original_size, new_size, elapsed = self.preprocessor.submit(
+            preprocess_photo, full_path, self.preprocess_dir, self.max_photo_side, self.jpeg_quality
+        ).result()
+        with self.stage_lock:
+            self.bytes_original += original_size
+            self.bytes_uploaded += new_size
+        self.metrics.observe("preprocess", elapsed)
+        self.metrics.inc("upload_bytes", new_size)
+        return upload_path
+
+    def log_stage_stats(self):
+        megabyte = 1024 * 1024
+        if self.preprocessor is not None:
+            self.log(
+                f"[🗜️] Сжатие: {self.bytes_original / megabyte:.1f} МБ -> {self.bytes_uploaded / megabyte:.1f} МБ "
+                f"(сэкономлено {(self.bytes_original - self.bytes_uploaded) / megabyte:.1f} МБ)"
+            )
+        stages = self.metrics.snapshot()["stages"]
+        slowest = sorted(stages.items(), key=lambda item: item[1]["sum"], reverse=True)[:5]
+        if slowest:
+            self.log("[⏱️] Время по этапам (сумма по потокам): " + ", ".join(
+                f"{stage} {stats['sum']:.1f} с ({stats['count']} шт, p95 {stats['p95']:.2f} с)"
+                for stage, stats in slowest
+            ))
+
+
+
+class CheckAndClearEngine:
+    """Подсчёт ("check") и очистка ("clear") отложки сообщества, без привязки к GUI."""
+
+    delete_workers = 3
+
+    def __init__(self, token, group_id, action="check", log=None, on_count=None, metrics_path=None, session=None):
+        self.log = log or (lambda message: None)
+        self.session = session
+        self.on_count = on_count or (lambda count: None)
+        self.token = token
+        self.group_id = group_id
+        self.action = action  
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+
+    def run(self):
+        self.http = HttpPool(pool_size=2) if self.session is None else self.session.http
+        http_since = self.http.stats()
+        try:
+            self.log("[📶] Подключение к API ВКонтакте...")
+            vk_session = self.http.vk_session(self.token, self.metrics)
+            vk = vk_session.get_api()
+            log_group(self.session, self.group_id, self.log)
+        except Exception as e:
+            self.log(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
+            close_http(self.session, self.http)
+            return {"status": "error", "count": None, "failed": [], "error": str(e)}
+
+        result = {"status": "ok", "count": None, "failed": []}
+        try:
+            self.log("[📝⏰] Получаем список отложенных записей...")
+
+            index = PostponedIndex(self.group_id)
+            # Перед удалением нужен точный список id, поэтому отложка обходится целиком.
+            if index.sync(vk, force=self.action == "clear") and self.action == "check":
+                self.log("[📝⏰] Индекс отложки расходился с ВК и был перестроен.")
+
+            count_posts = index.count()
+            result["count"] = count_posts
+            self.on_count(count_posts)
+
+            if self.action == "check":
+                self.log(f"[🔎] Найдено {count_posts} отложенных записей.")
+                first, last = index.bounds()
+                if first is not None:
+                    self.log(
+                        f"[📅] С {datetime.fromtimestamp(first).strftime('%Y-%m-%d %H:%M')} "
+                        f"по {datetime.fromtimestamp(last).strftime('%Y-%m-%d %H:%M')}"
+                    )
+            elif self.action == "clear":
+                self.log(f"[🧼🧼🧼] Начинаю удаление {count_posts} отложенных записей.")
+                post_ids = index.ids()
+                failed = self.delete_posts(vk_session, post_ids)
+                failed_ids = {post_id for post_id, _ in failed}
+                for post_id in post_ids:
+                    if post_id not in failed_ids:
+                        index.remove(post_id)
+                index.save()
+                result["failed"] = failed
+                if failed:
+                    result["status"] = "partial"
+                    self.log(f"[🧰ERROR] Не удалось удалить {len(failed)} из {count_posts} записей:")
+                    for post_id, reason in failed:
+                        self.log(f"[🧰ERROR] ID={post_id}: {reason}")
+                else:
+                    self.log(f"[👍] Все {count_posts} отложенных записей удалены.")
+        except Exception as e:
+            self.log(f"[🧰ERROR] Ошибка при работе с API: {e}")
+            result.update(status="error", error=str(e))
+
+        self.http.log_stats(self.log, self.metrics, http_since)
+        close_http(self.session, self.http)
+        if self.metrics_path:
+            try:
+                self.metrics.save(self.metrics_path)
+            except OSError as e:
+                self.log(f"[🤬WARN] Не удалось сохранить метрики в {self.metrics_path}: {e}")
+        return result
+
+    def delete_posts(self, vk_session, post_ids):
+        # Удаляем пачками по VkExecuteBatch.limit постов на один execute,
+        # не больше delete_workers пачек одновременно. Возвращает [(id, причина)].
+        owner_id = int(self.group_id)
+        chunks = [post_ids[i:i + VkExecuteBatch.limit] for i in range(0, len(post_ids), VkExecuteBatch.limit)]
+        progress_lock = threading.Lock()
+        done = 0
+        failed = []
+
+        def delete_chunk(chunk):
+            nonlocal done
+            batch = VkExecuteBatch(vk_session)
+            for post_id in chunk:
+                batch.add("wall.delete", owner_id=owner_id, post_id=post_id)
+            try:
+                errors = [
+                    (post_id, f"[{error['error_code']}] {error['error_msg']}")
+                    for post_id, (_, error) in zip(chunk, batch.run()) if error
+                ]
+            except Exception as e:
+                errors = [(post_id, str(e)) for post_id in chunk]
+            self.metrics.inc("deleted", len(chunk) - len(errors))
+            if errors:
+                self.metrics.inc("errors", len(errors), stage="delete")
+            with progress_lock:
+                failed.extend(errors)
+                done += len(chunk)
+                self.log(f"[🧼] Удалено {done - len(failed)}/{len(post_ids)}, ошибок: {len(failed)}")
+
+        with ThreadPoolExecutor(max_workers=self.delete_workers) as executor:
+            list(executor.map(delete_chunk, chunks))
+        return failed
+
+
+
+class EditPostponedEngine:
+    """Массовое изменение отложки через wall.edit, без повторной загрузки фото.
+
+    Выбираются записи с since <= publish_date < until (по умолчанию все).
+    shift - сдвиг в секундах; interval - разложить выбранные записи заново с
+    этим шагом, начиная со start (по умолчанию с первой из них); caption -
+    новая подпись (None - оставить как есть). Вызовы идут пачками по
+    VkExecuteBatch.limit через execute и общий RateLimiter токена.
+    """
+
+    def __init__(self, token, group_id, shift=0, interval=None, start=None, caption=None,
+                 since=None, until=None, log=None, metrics_path=None, session=None):
+        self.log = log or (lambda message: None)
+        self.session = session
+        self.token = token
+        self.group_id = group_id
+        self.shift = shift
+        self.interval = interval
+        self.start = start
+        self.caption = caption
+        self.since = since
+        self.until = until
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        self.retry_policy = RetryPolicy()
+
+    def run(self):
+        self.http = HttpPool(pool_size=2) if self.session is None else self.session.http
+        http_since = self.http.stats()
+        try:
+            self.log("[📶] Подключение к API ВКонтакте...")
+            vk_session = self.http.vk_session(self.token, self.metrics)
+            vk = vk_session.get_api()
+            log_group(self.session, self.group_id, self.log)
+        except Exception as e:
+            self.log(f"[🧰ERROR] Не удалось подключиться к API ВК: {e}")
+            close_http(self.session, self.http)
+            return {"status": "error", "count": 0, "failed": [], "error": str(e)}
+
+        result = {"status": "ok", "count": 0, "failed": []}
+        try:
+            self.log("[📝⏰] Получаем список отложенных записей...")
+            # wall.edit перезаписывает текст и вложения, поэтому нужны полные записи, а не только индекс.
+            # Заодно полный обход обновляет индекс отложки.
+            index = PostponedIndex(self.group_id)
+            posts = self.retry_policy.run(
+                lambda: list(index.crawl(vk)),
+                lambda attempt, delay, error: self.log(f"[🔄] Ошибка при чтении отложки: {error}, повтор через {delay:.1f} с"),
+            )
+            index.replace({item['id']: (item['date'], index.attachment_ids(item)) for item in posts})
+            items = [
+                item for item in posts
+                if (self.since is None or item['date'] >= self.since)
+                and (self.until is None or item['date'] < self.until)
+            ]
+            edits = self.plan_edits(items)
+            result["count"] = len(edits)
+            self.log(f"[✏️] Изменяю {len(edits)} из {len(items)} выбранных записей.")
+
+            failed = self.edit_posts(vk_session, edits)
+            failed_ids = {post_id for post_id, _ in failed}
+            for params in edits:
+                if params["post_id"] not in failed_ids:
+                    attachments = [a for a in params["attachments"].split(",") if a and "://" not in a]
+                    index.add(params["post_id"], params["publish_date"], attachments)
+            index.save()
+            result["failed"] = failed
+            if failed:
+                result["status"] = "partial"
+                self.log(f"[🧰ERROR] Не удалось изменить {len(failed)} из {len(edits)} записей:")
+                for post_id, reason in failed:
+                    self.log(f"[🧰ERROR] ID={post_id}: {reason}")
+            elif edits:
+                self.log(f"[👍] Все {len(edits)} записей изменены.")
+        except Exception as e:
+            self.log(f"[🧰ERROR] Ошибка при работе с API: {e}")
+            result.update(status="error", error=str(e))
+
+        self.http.log_stats(self.log, self.metrics, http_since)
+        close_http(self.session, self.http)
+        if self.metrics_path:
+            try:
+                self.metrics.save(self.metrics_path)
+            except OSError as e:
+                self.log(f"[🤬WARN] Не удалось сохранить метрики в {self.metrics_path}: {e}")
+        return result
+
+    def plan_edits(self, items):
+        # Параметры wall.edit для каждой записи в том порядке, в котором их безопасно
+        # отправлять: запись не должна переезжать на время, которое ещё занято другой.
+        items = sorted(items, key=lambda item: item['date'])
+        first = self.start if self.start is not None else (items[0]['date'] if items else 0)
+        min_date = int(time.time()) + 60
+        edits = []
+        for number, item in enumerate(items):
+            publish_date = item['date']
+            if self.interval:
+                publish_date = first + number * int(self.interval)
+            publish_date += int(self.shift or 0)
+            message = item.get('text', '') if self.caption is None else self.caption
+            if publish_date == item['date'] and message == item.get('text', ''):
+                continue
+            if publish_date < min_date:
+                self.log(
+                    f"[🤬WARN] ID={item['id']}: новое время {datetime.fromtimestamp(publish_date).strftime('%Y-%m-%d %H:%M')} "
+                    f"уже прошло, запись пропущена."
+                )
+                continue
+            edits.append({
+                "owner_id": int(self.group_id),
+                "post_id": item['id'],
+                "message": message,
+                "attachments": ",".join(self.attachments(item)),
+                "publish_date": publish_date,
+                "old_date": item['date'],
+            })
+        moved = {edit["post_id"] for edit in edits}
+        taken = sorted(
+            [item['date'] for item in items if item['id'] not in moved] + [edit["publish_date"] for edit in edits]
+        )
+        clashes = sum(1 for a, b in zip(taken, taken[1:]) if b - a < SlotAllocator.min_gap)
+        if clashes:
+            self.log(f"[🤬WARN] После изменения {clashes} записей окажутся в одно время с другими.")
+        # Сначала записи, которые едут раньше (от ранних к поздним), затем едущие позже - с конца.
+        earlier = [edit for edit in edits if edit["publish_date"] <= edit["old_date"]]
+        later = [edit for edit in edits if edit["publish_date"] > edit["old_date"]]
+        ordered = earlier + later[::-1]
+        for edit in ordered:
+            del edit["old_date"]
+        return ordered
+
+    @staticmethod
+    def attachments(item):
+        # Всё, что можно передать обратно в wall.edit: медиа по id, ссылки по url.
+        result = []
+        for attachment in item.get('attachments', []):
+            media = attachment.get(attachment.get('type'), {})
+            if attachment.get('type') == 'link' and media.get('url'):
+                result.append(media['url'])
+            elif 'owner_id' in media and 'id' in media:
+                media_id = f"{attachment['type']}{media['owner_id']}_{media['id']}"
+                if media.get('access_key'):
+                    media_id += f"_{media['access_key']}"
+                result.append(media_id)
+        return result
+
+    def edit_posts(self, vk_session, edits):
+        # Пачки идут по очереди, чтобы сохранить порядок из plan_edits. Временные ошибки
+        # повторяются с паузой RetryPolicy. Возвращает [(id, причина)].
+        failed = []
+        pending = edits
+        done = 0
+        for attempt in range(self.retry_policy.attempts):
+            retry = []
+            for start in range(0, len(pending), VkExecuteBatch.limit):
+                chunk = pending[start:start + VkExecuteBatch.limit]
+                batch = VkExecuteBatch(vk_session)
+                for params in chunk:
+                    batch.add("wall.edit", **params)
+                try:
+                    results = batch.run()
+                except Exception as e:
+                    results = [(None, e)] * len(chunk)
+                for params, (_, error) in zip(chunk, results):
+                    if error is None:
+                        done += 1
+                    elif attempt + 1 < self.retry_policy.attempts and self.retry_policy.is_transient(error):
+                        retry.append(params)
+                    else:
+                        failed.append((params["post_id"], PostingEngine.error_text(error)))
+                self.metrics.inc("edited", len(chunk) - sum(1 for _, error in results if error))
+                self.log(f"[✏️] Изменено {done}/{len(edits)}, ошибок: {len(failed)}")
+            if not retry:
+                break
+            delay = self.retry_policy.delay(attempt)
+            self.metrics.inc("retries", len(retry), stage="edit")
+            self.log(f"[🔄] {len(retry)} записей не изменились, повтор через {delay:.1f} с")
+            time.sleep(delay)
+            pending = retry
+        if failed:
+            self.metrics.inc("errors", len(failed), stage="edit")
+        return failed
+
+
+
+class FanoutScheduler:
+    """Параллельный постинг в несколько сообществ.
+
+    jobs - список словарей с ключами token, group_id, folder и необязательными
+    interval_hours, start_timestamp, photos_per_post, caption, use_random_emoji,
+    photo_order, album_id. Одновременно идёт не больше max_jobs заданий, а загрузок
+    по всем заданиям - не больше max_uploads. Лимит запросов к API и ApiSession
+    (соединения, время сервера) общие для заданий с одним токеном.
+    """
+
+    progress_interval = 5.0
+
+    def __init__(self, jobs, max_jobs=3, max_uploads=18, log=None, on_progress=None):
+        self.jobs = jobs
+        self.max_jobs = max_jobs
+        self.upload_slots = threading.BoundedSemaphore(max_uploads)
+        self.log = log or (lambda job, message: None)
+        self.on_progress = on_progress or (lambda report: None)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.reported_at = 0.0
+        self.states = [
+            {"job": self.job_name(job), "status": "queued", "posts": 0, "failed": 0, "last_post_time": None}
+            for job in jobs
+        ]
+
+    @staticmethod
+    def job_name(job):
+        return job.get("name") or f"{job['group_id']}:{os.path.basename(os.path.normpath(job['folder']))}"
+
+    def report(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.reported_at < self.progress_interval:
+                return
+            self.reported_at = now
+            jobs = [dict(state) for state in self.states]
+        totals = {
+            "jobs": len(jobs),
+            "running": sum(state["status"] == "running" for state in jobs),
+            "finished": sum(state["status"] in ("ok", "partial", "error") for state in jobs),
+            "posts": sum(state["posts"] for state in jobs),
+            "failed": sum(state["failed"] for state in jobs),
+        }
+        self.on_progress({"totals": totals, "jobs": jobs})
+
+    def run_job(self, number):
+        job = self.jobs[number]
+        state = self.states[number]
+        name = state["job"]
+
+        def on_post_time(publish_date):
+            with self.lock:
+                state["posts"] += 1
+                state["last_post_time"] = publish_date
+            self.report()
+
+        with self.lock:
+            state["status"] = "running"
+        self.report(force=True)
+        try:
+            engine = PostingEngine(
+                job["token"],
+                normalize_group_id(job["group_id"]),
+                int(job.get("interval_hours", 2)),
+                job["folder"],
+                int(job.get("start_timestamp") or time.time()),
+                str(job.get("photos_per_post", 9)),
+                job.get("caption", ""),
+                bool(job.get("use_random_emoji")),
+                list(EMOJI_LIST),
+                job.get("photo_order", "name"),
+                log=lambda message: self.log(name, message),
+                on_post_time=on_post_time,
+                upload_slots=self.upload_slots,
+                save_settings=False,
+                album_id=job.get("album_id"),
+                session=self.session(job["token"]),
+            )
+            result = engine.run()
+        except Exception as e:
+            self.log(name, f"[🧰ERROR] Задание не запустилось: {e}")
+            result = {"status": "error", "posts": 0, "failed": 0, "error": str(e)}
+        with self.lock:
+            state["status"] = result["status"]
+            state["failed"] = result.get("failed", 0)
+        self.report(force=True)
+        return {"job": name, **result}
+
+    def session(self, token):
+        with self.lock:
+            if token not in self.sessions:
+                self.sessions[token] = ApiSession(token)
+            return self.sessions[token]
+
+    def run(self):
+        # Возвращает итог по каждому заданию в порядке jobs.
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+                results = list(executor.map(self.run_job, range(len(self.jobs))))
+        finally:
+            for session in self.sessions.values():
+                session.close()
+        self.report(force=True)
+        return results
@@ -0,0 +1,157 @@
+"""Продолжение запусков по журналу на локальном mock-сервере (bench/mock_vk.py).
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="postal_tests_")
+# Журнал, кэш и индекс postal_core лежат рядом с sys.argv[0]: подменяем его до импорта.
+sys.argv[0] = os.path.join(WORKDIR, "tests")
+sys.path[:0] = [ROOT, os.path.join(ROOT, "bench")]
+
+import postal_core
+from mock_vk import MockVk
+
+BROKEN = b"postal-test-broken-photo"
+REJECTED = b"postal-test-rejected-photo"
+
+
+class FlakyVk(MockVk):
+    # Фото с меткой BROKEN сервер загрузки не принимает, с меткой REJECTED отвечает
+    # полем error, а wall.post с номером из fail_posts отвечает постоянной ошибкой
+    # (пост не создаётся).
+
+    def __init__(self, fail_posts=(), **kwargs):
+        super().__init__(**kwargs)
+        self.fail_posts = set(fail_posts)
+        self.post_calls = 0
+        self.rejected_uploads = 0
+
+    def upload(self, body, album=False):
+        if REJECTED in body:
+            with self.lock:
+                self.rejected_uploads += 1
+            return {"error": "ERR_UPLOAD_BAD_IMAGE_SIZE: photo size is wrong"}
+        if BROKEN in body:
+            return {"server": 1, "photo": "[]", "hash": "0" * 32}
+        return super().upload(body, album)
+
+    def method_wall_post(self, params):
+        with self.lock:
+            self.post_calls += 1
+            number = self.post_calls
+        if number in self.fail_posts:
+            return {"error": {"error_code": 100, "error_msg": "One of the parameters specified was missing or invalid"}}
+        return super().method_wall_post(params)
+
+
+class ResumeTest(unittest.TestCase):
+
+    def setUp(self):
+        for name in os.listdir(WORKDIR):
+            path = os.path.join(WORKDIR, name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        self.folder = os.path.join(WORKDIR, "photos")
+        os.makedirs(self.folder)
+        self.start = int(time.time()) + 3600
+
+    def start_mock(self, **kwargs):
+        mock = FlakyVk(**kwargs).start()
+        self.addCleanup(mock.stop)
+        postal_core.HttpPool.api_url = mock.api_url
+        return mock
+
+    def write_photo(self, name, content=None):
+        with open(os.path.join(self.folder, name), "wb") as f:
+            f.write(content if content is not None else os.urandom(2048))
+
+    def run_engine(self, **kwargs):
+        engine = postal_core.PostingEngine(
+            "test-token", "-1", 1, self.folder, self.start, "1", save_settings=False, **kwargs
+        )
+        engine.retry_policy.base = 0.01
+        return engine.run()
+
+    def journal_states(self):
+        conn = sqlite3.connect(postal_core.JOURNAL_PATH)
+        try:
+            return conn.execute("SELECT run_id, name, state FROM files ORDER BY run_id, name").fetchall()
+        finally:
+            conn.close()
+
+    def test_resume_after_dead_letter_rerun(self):
+        # p1 не загружается (очередь неудавшихся), p2 публикуется, у p3 wall.post
+        # падает, поэтому запуск остаётся незавершённым.
+        mock = self.start_mock(fail_posts={2})
+        self.write_photo("p1.jpg", BROKEN + os.urandom(2048))
+        self.write_photo("p2.jpg")
+        self.write_photo("p3.jpg")
+        result = self.run_engine()
+        self.assertEqual((result["posts"], result["held"], result["failed"]), (1, 1, 1))
+
+        # Фото исправили и повторили очередь неудавшихся: p1 публикуется отдельным запуском.
+        self.write_photo("p1.jpg")
+        result = self.run_engine(dead_letters=True)
+        self.assertEqual(result["posts"], 1)
+
+        # Продолжение исходного запуска публикует только p3, p1 уже не его.
+        result = self.run_engine()
+        self.assertEqual((result["status"], result["posts"]), ("ok", 1))
+        self.assertEqual(len(mock.posts), 3)
+        self.assertIn((1, "p1.jpg", "requeued"), self.journal_states())
+
+    def test_resume_skips_duplicate_of_journaled_photo(self):
+        # b - копия a; у c wall.post падает, запуск остаётся незавершённым.
+        mock = self.start_mock(fail_posts={2})
+        content = os.urandom(2048)
+        self.write_photo("a.jpg", content)
+        self.write_photo("b.jpg", content)
+        self.write_photo("c.jpg")
+        result = self.run_engine()
+        self.assertEqual((result["posts"], result["failed"]), (1, 1))
+
+        result = self.run_engine()
+        self.assertEqual((result["status"], result["posts"]), ("ok", 1))
+        attachments = [post["attachments"] for post in mock.posts.values()]
+        self.assertEqual(len(attachments), 2)
+        self.assertEqual(len(set(attachments)), 2)
+
+    def test_upload_error_is_not_retried(self):
+        # Ответ сервера загрузки с полем error - постоянная ошибка: без повторов сразу в очередь неудавшихся.
+        mock = self.start_mock()
+        self.write_photo("bad.jpg", REJECTED + os.urandom(2048))
+        self.write_photo("good.jpg")
+        result = self.run_engine()
+        self.assertEqual((result["posts"], result["held"]), (1, 1))
+        self.assertEqual(mock.rejected_uploads, 1)
+        self.assertIn((1, "bad.jpg", "dead"), self.journal_states())
+
+    def test_duplicates_do_not_count_as_unplanned(self):
+        # Место в отложке есть для трёх постов; d - копия a, поэтому постов ровно три.
+        self.start_mock()
+        queue_cap = postal_core.SlotAllocator.queue_cap
+        postal_core.SlotAllocator.queue_cap = 3
+        self.addCleanup(setattr, postal_core.SlotAllocator, "queue_cap", queue_cap)
+        content = os.urandom(2048)
+        self.write_photo("a.jpg", content)
+        self.write_photo("b.jpg")
+        self.write_photo("c.jpg")
+        self.write_photo("d.jpg", content)
+        result = self.run_engine()
+        self.assertEqual((result["status"], result["posts"], result["unplanned"]), ("ok", 3, 0))
+
+
+def tearDownModule():
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    unittest.main()